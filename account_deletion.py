@@ -0,0 +1,138 @@
+# Background deletion of accounts too large to delete within one request
+#
+# A job calls step(user_id, chunk_size) until it reports nothing was left to
+# delete. Every step is its own short transaction, so other writers are never
+# locked out for long. Jobs are kept in the account_deletion table rather than
+# in the worker that took the request, so any worker can report progress, and
+# a job whose worker exits halfway (recycled, killed) is run again from where
+# it stopped: every worker looks for such jobs when its thread starts and
+# whenever it has been idle for a lease, and `flask resume-account-deletions`
+# runs them in the foreground. A worker claims a job before running it and
+# touches it on every step; a job left untouched for a lease is up for grabs.
+import atexit
+import logging
+import os
+import queue
+import socket
+import threading
+
+logger = logging.getLogger('account_deletion')
+
+
+class DeletionQueue:
+    def __init__(self, chunk_size=5000, lease=300):
+        self.chunk_size = chunk_size
+        self.lease = lease
+        self.step = None
+        self.claim = None
+        self.save = None
+        self.unfinished = None
+        # job ids this worker will try to claim, oldest first
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.closed = False
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.released = 0
+
+    def init_app(self, app, step, claim, save, unfinished):
+        # step(user_id, chunk_size) deletes one chunk and returns how many rows went, 0 once done;
+        # claim(job_id, runner, lease) marks a stored job as held by runner and returns it as a dict,
+        # or None if it is done or another runner touched it within lease seconds;
+        # save(job_id, runner, changes) updates a job runner still holds, and returns False if it doesn't;
+        # unfinished(failed) returns the ids of jobs not done yet, failed ones only if asked
+        self.step = step
+        self.claim = claim
+        self.save = save
+        self.unfinished = unfinished
+        self.chunk_size = app.config.get('ACCOUNT_DELETE_CHUNK_SIZE', self.chunk_size)
+        self.lease = app.config.get('ACCOUNT_DELETE_LEASE', self.lease)
+        atexit.register(self.close)
+
+    def submit(self, job_id):
+        # for a job already stored as queued
+        self.queue.put(job_id)
+        self.start()
+
+    def start(self):
+        # started on first use, and again in a forked worker where the thread didn't survive
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._run, name='account-deletion', daemon=True)
+                self.thread.start()
+
+    def _rescan(self):
+        # queues jobs left behind by workers that exited; claims keep two workers off the same one
+        try:
+            for job_id in self.unfinished(False):
+                self.queue.put(job_id)
+        except Exception:
+            logger.exception('looking for unfinished account deletions failed')
+
+    def _run(self):
+        self._rescan()
+        while not self.closed:
+            try:
+                job_id = self.queue.get(timeout=self.lease)
+            except queue.Empty:
+                self._rescan()
+                continue
+            if job_id is not None:
+                self.run(job_id)
+
+    def run(self, job_id):
+        # runs one job to the end in the calling thread; False if it wasn't ours to run or didn't finish
+        runner = f'{socket.gethostname()}:{os.getpid()}'
+        job = self.claim(job_id, runner, self.lease)
+        if job is None:
+            return False
+        deleted = job['deleted']
+        self.running += 1
+        try:
+            while True:
+                if self.closed:
+                    # shutting down: hand it back, so the next worker needn't wait out the lease
+                    self.save(job_id, runner, {'state': 'queued', 'deleted': deleted})
+                    self.released += 1
+                    return False
+                count = self.step(job['user_id'], self.chunk_size)
+                deleted += count
+                if not count:
+                    self.save(job_id, runner, {'state': 'done', 'deleted': deleted})
+                    self.completed += 1
+                    return True
+                if not self.save(job_id, runner, {'deleted': deleted}):
+                    logger.warning('account deletion %s was taken over by another worker', job_id)
+                    return False
+        except Exception:
+            logger.exception('deleting account %s failed', job['user_id'])
+            self.failed += 1
+            try:
+                self.save(job_id, runner, {'state': 'failed', 'deleted': deleted})
+            except Exception:
+                # left running; another worker takes it over once the lease runs out
+                logger.exception('account deletion %s not marked failed', job_id)
+            return False
+        finally:
+            self.running -= 1
+
+    def close(self):
+        self.closed = True
+        # wakes the thread if it is waiting for work
+        self.queue.put(None)
+        if self.thread is not None and self.pid == os.getpid():
+            self.thread.join(timeout=5)
+
+    def stats(self):
+        # this worker's share; the table has every job
+        return {
+            'queued': self.queue.qsize(),
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'handed_back': self.released,
+        }
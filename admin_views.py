@@ -0,0 +1,34 @@
+# Admin-only views mounted under /admin
+from flask_admin import BaseView, expose
+from flask_login import current_user
+
+
+class AdminOnlyView(BaseView):
+    def __init__(self, admin_usernames, **kwargs):
+        super().__init__(**kwargs)
+        self.admin_usernames = admin_usernames
+
+    def is_accessible(self):
+        return current_user.is_authenticated and current_user.username in self.admin_usernames
+
+
+class ProfilerView(AdminOnlyView):
+    def __init__(self, profiler, admin_usernames, **kwargs):
+        super().__init__(admin_usernames, **kwargs)
+        self.profiler = profiler
+
+    @expose('/')
+    def index(self):
+        return self.render('admin/profiler.html', enabled=self.profiler.enabled, routes=self.profiler.stats())
+
+
+class MetricsView(AdminOnlyView):
+    # sources: section name -> callable returning a flat dict of numbers
+    def __init__(self, sources, admin_usernames, **kwargs):
+        super().__init__(admin_usernames, **kwargs)
+        self.sources = sources
+
+    @expose('/')
+    def index(self):
+        sections = {name: source() for name, source in self.sources.items()}
+        return self.render('admin/metrics.html', sections=sections)
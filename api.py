@@ -0,0 +1,136 @@
+# Helpers for the versioned JSON API (/api/v1 routes in app.py)
+#
+# Requests pick their output with ?fields=a,b and ?include=x,y, which are
+# checked against what each resource allows. Bodies are serialized once to
+# compact JSON (with orjson, if installed), compressed when the client takes
+# it, and carry a weak ETag (the same for every encoding) so an unchanged
+# resource is answered with a bodiless 304.
+import gzip
+import hashlib
+import json
+from functools import wraps
+
+from flask import current_app, request, url_for
+from flask_login import current_user
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib json module is used without it
+    orjson = None
+try:
+    import brotli
+except ImportError:  # optional: gzip only without it
+    brotli = None
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# smaller bodies aren't worth compressing
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def init_app(app):
+    app.register_error_handler(ApiError, error_response)
+
+
+def error_response(error):
+    response = current_app.response_class(encode({'error': error.message}), status=error.status,
+                                          mimetype='application/json')
+    response.cache_control.no_store = True
+    return response
+
+
+def login_required(view):
+    # 401 in JSON instead of a redirect to the login page
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not current_user.is_authenticated:
+            raise ApiError(401, 'login required')
+        return view(*args, **kwargs)
+    return wrapped
+
+
+def page_size():
+    return min(max(request.args.get('limit', DEFAULT_LIMIT, type=int), 1), MAX_LIMIT)
+
+
+def requested(name, allowed, default):
+    # the comma-separated ?name= values, in order and deduplicated, or default when absent
+    raw = request.args.get(name)
+    if raw is None:
+        return default
+    chosen = tuple(dict.fromkeys(value for value in raw.split(',') if value))
+    unknown = [value for value in chosen if value not in allowed]
+    if unknown:
+        raise ApiError(400, f'unknown {name}: {", ".join(unknown)}; allowed: {", ".join(allowed)}')
+    return chosen
+
+
+def next_link(param, value):
+    # this request's URL with param moved on to value, or None on the last page;
+    # a query arg named like a path parameter gives way to it
+    if value is None:
+        return None
+    args = request.args.to_dict()
+    args[param] = value
+    args.update(request.view_args)
+    return url_for(request.endpoint, **args)
+
+
+def _default(value):
+    # datetimes are stored as naive UTC
+    if hasattr(value, 'isoformat'):
+        return value.isoformat() + '+00:00'
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def encode(payload):
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NAIVE_UTC)
+    return json.dumps(payload, separators=(',', ':'), ensure_ascii=False, default=_default).encode('utf-8')
+
+
+def validator(*parts):
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def not_modified(etag):
+    # a 304 when the client already holds etag; lets a route skip loading anything
+    if request.if_none_match.contains_weak(etag):
+        return _finish(current_app.response_class(status=304), etag)
+    return None
+
+
+def respond(payload, etag=None):
+    # etag: a validator computed up front; otherwise one is taken from the body
+    body = encode(payload)
+    etag = etag or hashlib.blake2b(body, digest_size=16).hexdigest()
+    response = not_modified(etag)
+    if response is not None:
+        return response
+    response = current_app.response_class(body, mimetype='application/json')
+    if len(body) >= COMPRESS_MIN_BYTES:
+        if brotli is not None and 'br' in request.accept_encodings:
+            response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+            response.content_encoding = 'br'
+        elif 'gzip' in request.accept_encodings:
+            response.set_data(gzip.compress(body, GZIP_LEVEL, mtime=0))
+            response.content_encoding = 'gzip'
+    return _finish(response, etag)
+
+
+def _finish(response, etag):
+    response.set_etag(etag, weak=True)
+    # per session, so only the client keeps it, and it checks back every time
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.update(('Cookie', 'Accept-Encoding'))
+    return response
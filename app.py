@@ -1,39 +1,175 @@
-from flask import Flask, request, render_template, url_for, redirect, flash
+import os
+import time
+import secrets
+BOOT_STARTED = time.perf_counter()  # startup time is measured from here, before the heavy imports
+import hashlib
+import math
+import calendar
+import click
+from flask import Flask, request, render_template, url_for, redirect, flash, jsonify, abort, session, make_response
 from flask_sqlalchemy import SQLAlchemy
-from falsk_sqlalchemy import desc
-from flask_admin import Admin
+from werkzeug.middleware.proxy_fix import ProxyFix
+from sqlalchemy import and_, delete, event, func, or_, select, tuple_, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import joinedload, selectinload, make_transient_to_detached
 # from flask_admin.contrib.sqla import ModelView
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
-from flask_socketio import SocketIO
+from datetime import datetime, timedelta
+from collections import Counter
+from flask_socketio import SocketIO, join_room, leave_room
+from profiler import QueryProfiler
+from like_buffer import LikeBuffer
+from identity_cache import IdentityCache
+from passwords import PasswordPolicy, PasswordBusy
+from account_deletion import DeletionQueue
+from fragment_cache import FragmentCache
+from category_catalog import CategoryCatalog
+from trending import TrendingIndex
+from rate_limit import RateLimiter, parse_limits
+from signals import (post_changed, post_deleted, comment_added, comment_deleted,
+                     category_counts_changed, category_added, posts_changed, likes_added)
+import migrations
+import search
+import bulk
+import assets
+import trending
+import serving
+import api
 
 app = Flask(__name__)
 
-socketio = SocketIO(app)
+# attached by create_app(); CLI commands and migrations never start it
+socketio = SocketIO()
 
 login_manager = LoginManager()
 login_manager.login_view = 'login'
 login_manager.init_app(app)
 
+def engine_options(config):
+    # explicit pool sizing for file and server databases; in-memory SQLite keeps its single connection
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': url.get_backend_name() != 'sqlite',
+    }
+
 #configuring the database
-app.config['SQLALCHEMY_DATABASE_URI']= 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS']=False
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+# SQLite connection profile: WAL lets readers run alongside the single writer,
+# and writers wait on the lock for up to the busy timeout instead of failing
+app.config['SQLITE_JOURNAL_MODE'] = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
 app.config['SECRET_KEY'] = '123987456'
+# SQL profiling: query count/time headers per request, stats under /admin/profiler
+app.config['SQL_PROFILING'] = os.environ.get('SQL_PROFILING') == '1'
+app.config['SQL_SLOW_QUERY_MS'] = float(os.environ.get('SQL_SLOW_QUERY_MS', 100))
+app.config['ADMIN_USERNAMES'] = set(filter(None, os.environ.get('ADMIN_USERNAMES', '').split(',')))
+# memory cap for rendered post cards
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+# likes are acknowledged at once and written in batches every interval (seconds) or at this many pending
+app.config['LIKE_FLUSH_INTERVAL'] = float(os.environ.get('LIKE_FLUSH_INTERVAL', 0.5))
+app.config['LIKE_FLUSH_SIZE'] = int(os.environ.get('LIKE_FLUSH_SIZE', 500))
+# failed batches are retried on the next flush, and dropped after this many failures in a row
+app.config['LIKE_FLUSH_ATTEMPTS'] = int(os.environ.get('LIKE_FLUSH_ATTEMPTS', 5))
+# password hashing: scrypt:n:r:p or pbkdf2:<hash>:<iterations>, run on a bounded worker pool
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', 4))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64))
+# logged-in users kept in memory between requests; each worker has its own copy,
+# so the TTL bounds how long a password change or deletion in another worker goes unseen
+app.config['IDENTITY_CACHE_SIZE'] = int(os.environ.get('IDENTITY_CACHE_SIZE', 10000))
+app.config['IDENTITY_CACHE_TTL'] = float(os.environ.get('IDENTITY_CACHE_TTL', 10))
+# category list and post counts kept in memory, reloaded at least this often (seconds)
+app.config['CATEGORY_CATALOG_TTL'] = float(os.environ.get('CATEGORY_CATALOG_TTL', 300))
+# accounts with more posts, comments and likes than this are deleted in the background, in chunks
+app.config['ACCOUNT_DELETE_SYNC_LIMIT'] = int(os.environ.get('ACCOUNT_DELETE_SYNC_LIMIT', 200000))
+app.config['ACCOUNT_DELETE_CHUNK_SIZE'] = int(os.environ.get('ACCOUNT_DELETE_CHUNK_SIZE', 5000))
+# seconds a background deletion may go untouched before another worker takes it over
+app.config['ACCOUNT_DELETE_LEASE'] = float(os.environ.get('ACCOUNT_DELETE_LEASE', 300))
+# trending posts: score half-life, posts ranked in memory, and seconds between saves to the table
+app.config['TRENDING_HALF_LIFE_HOURS'] = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', 24))
+app.config['TRENDING_CAPACITY'] = int(os.environ.get('TRENDING_CAPACITY', 10000))
+app.config['TRENDING_PERSIST_INTERVAL'] = float(os.environ.get('TRENDING_PERSIST_INTERVAL', 60))
+# `flask build-assets` output under static/, served fingerprinted when present
+app.config['STATIC_BUILD_DIR'] = os.environ.get('STATIC_BUILD_DIR', 'dist')
+
+# SOCKETIO_MESSAGE_QUEUE (e.g. redis://localhost:6379/0) lets several worker
+# processes share broadcasts; without it events stay in this process
+app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+# load the category catalog and trending ranking before serving; with a
+# preloaded gunicorn master, forked workers start with them in place
+app.config['WARM_START'] = os.environ.get('WARM_START', '1') == '1'
+app.config['ADMIN_ENABLED'] = os.environ.get('ADMIN_ENABLED', '1') == '1'
+# number of reverse proxies in front of the app whose X-Forwarded-For is trusted;
+# per-address rate limits would otherwise see only the proxy
+app.config['TRUSTED_PROXY_COUNT'] = int(os.environ.get('TRUSTED_PROXY_COUNT', 0))
+
+# token buckets as rule=capacity/seconds; RATE_LIMITS overrides single rules
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+app.config['RATE_LIMITS'] = {**parse_limits('like_post=60/60,add_comment=10/60,login=20/60,'
+                                            'login_account=5/300,register=5/3600'),
+                             **parse_limits(os.environ.get('RATE_LIMITS'))}
+# a SQLite file shared by the workers on one host; per-process buckets without it
+app.config['RATE_LIMIT_SQLITE_PATH'] = os.environ.get('RATE_LIMIT_SQLITE_PATH')
+app.config['RATE_LIMIT_MAX_KEYS'] = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
 db = SQLAlchemy(app)
 
-admin = Admin(app)
+if app.config['TRUSTED_PROXY_COUNT']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
+
+def apply_sqlite_profile(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT_MS']}")
+    # off by default in SQLite; deletes rely on ON DELETE CASCADE
+    cursor.execute("PRAGMA foreign_keys=ON")
+    # save_trending's upsert needs ln() and exp(), which builds without math functions lack
+    if not cursor.execute("SELECT 1 FROM pragma_compile_options "
+                          "WHERE compile_options = 'ENABLE_MATH_FUNCTIONS'").fetchone():
+        dbapi_connection.create_function('ln', 1, math.log, deterministic=True)
+        dbapi_connection.create_function('exp', 1, math.exp, deterministic=True)
+    cursor.close()
+
+profiler = QueryProfiler()
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', apply_sqlite_profile)
+    profiler.init_app(app, db.engine)
+
 
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(120), nullable=False)
-    posts = db.relationship('Post', backref='author', lazy=True)
-    comments = db.relationship('Comment', backref='author', lazy=True)
+    password = db.Column(db.String(255), nullable=False)
+    # the database cascades deletes of a user to everything they wrote or liked (migration 7)
+    posts = db.relationship('Post', backref='author', lazy=True, passive_deletes=True)
+    comments = db.relationship('Comment', backref='author', lazy=True, passive_deletes=True)
     joined_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
+    @property
+    def credential_stamp(self):
+        # changes with the password hash, which logs out sessions holding the old one
+        return hashlib.sha256(self.password.encode()).hexdigest()[:16]
+
+    def get_id(self):
+        return f'{self.id}:{self.credential_stamp}'
 
     def __repr__(self):
         return f'<User {self.id}: {self.username}>'
@@ -43,20 +179,28 @@ class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(120), nullable=False)
     content = db.Column(db.Text, nullable=False)
-    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    categories = db.relationship('Category', secondary='post_categories', backref='posts')
-    likes = db.relationship('Like', backref='post', lazy=True)
-    comments = db.relationship('Comment', cascade='all,delete', backref='post', lazy=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)
+    categories = db.relationship('Category', secondary='post_categories', backref='posts', passive_deletes=True)
+    likes = db.relationship('Like', backref='post', lazy=True, passive_deletes=True)
+    comments = db.relationship('Comment', cascade='all,delete', backref='post', lazy=True, passive_deletes=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # denormalized counters, kept in step with atomic UPDATEs (see bump_counter)
+    like_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # bumped on every change to the row, so cached renderings can key on it
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # feed is ordered and paginated on (created_at, id), profiles on (author_id, created_at, id)
+    __table_args__ = (db.Index('ix_post_created_at_id', 'created_at', 'id'),
+                      db.Index('ix_post_author_id_created_at_id', 'author_id', 'created_at', 'id'))
 
     def __repr__(self):
         return f'<Post {self.id}: {self.title}>'
 
 class Like(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'))
-    user = db.relationship('User', backref='likes')
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), index=True)
+    user = db.relationship('User', backref=db.backref('likes', passive_deletes=True))
     __table_args__ = (db.UniqueConstraint('user_id', 'post_id', name='unique_like'),)
 
 
@@ -64,19 +208,55 @@ class Category(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(80), unique=True, nullable=False)
     post_categories = db.Table('post_categories',
-    db.Column('post_id', db.Integer, db.ForeignKey('post.id'), primary_key=True),
-    db.Column('category_id', db.Integer, db.ForeignKey('category.id'), primary_key=True))
+    db.Column('post_id', db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('category_id', db.Integer, db.ForeignKey('category.id', ondelete='CASCADE'), primary_key=True),
+    # category feeds read post ids straight out of this index
+    db.Index('ix_post_categories_category_id_post_id', 'category_id', 'post_id'))
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
 
     def __repr__(self):
         return f'<Category {self.id}: {self.name}>'
 
+class UserStats(db.Model):
+    # per-user counters for profile pages, kept in step like the post counters
+    # (see bump_user_stats) and repaired by reconcile-counters
+    __tablename__ = 'user_stats'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    likes_received = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    likes_given = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+
+class AccountDeletion(db.Model):
+    # background account deletions (see account_deletion.py); no foreign key, as
+    # the row outlives the user so progress can still be read once it is done
+    __tablename__ = 'account_deletion'
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    state = db.Column(db.String(16), nullable=False, default='queued', server_default='queued', index=True)
+    total = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # hostname:pid of the worker holding it, and when it last finished a step
+    runner = db.Column(db.String(120))
+    touched_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+
+class TrendingScore(db.Model):
+    # log2 of the post's time-decayed activity, merged in by TrendingIndex.persist()
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), primary_key=True)
+    score = db.Column(db.Float, nullable=False, index=True)
+
+
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
-    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False, index=True)
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id', ondelete='CASCADE'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
    
@@ -84,8 +264,616 @@ class Comment(db.Model):
     def __repr__(self):
         return f'<Comment {self.id} on post {self.post_id}>'
 
-with app.app_context():
-    db.create_all()
+# Post counters
+def bump_counter(post_id, column, delta):
+    # single UPDATE post SET x = x + delta, so concurrent writers never lose counts
+    Post.query.filter_by(id=post_id).update({column: column + delta, Post.version: Post.version + 1},
+                                            synchronize_session=False)
+
+def reconcile_counters():
+    # recompute every counter from the source tables and repair the drifted ones;
+    # the version moves too, so cached cards and ETags of repaired posts go stale
+    likes = select(func.count(Like.id)).where(Like.post_id == Post.id).scalar_subquery()
+    comments = select(func.count(Comment.id)).where(Comment.post_id == Post.id).scalar_subquery()
+    repaired = (Post.query
+                .filter(or_(Post.like_count != likes, Post.comment_count != comments))
+                .update({Post.like_count: likes, Post.comment_count: comments, Post.version: Post.version + 1},
+                        synchronize_session=False))
+    db.session.commit()
+    return repaired
+
+# User counters
+USER_COUNTERS = ('post_count', 'likes_received', 'comment_count', 'likes_given')
+
+def bump_user_stats(user_id, column, delta):
+    UserStats.query.filter_by(user_id=user_id).update({column: column + delta}, synchronize_session=False)
+
+def shift_user_stats(counts, sign=1):
+    # counts: a select of user_id plus columns named after the counters they move;
+    # applied to every user in it with one UPDATE ... FROM
+    counts = counts.subquery()
+    db.session.execute(
+        update(UserStats).where(UserStats.user_id == counts.c.user_id)
+        .values({name: getattr(UserStats, name) + sign * counts.c[name]
+                 for name in counts.c.keys() if name != 'user_id'})
+        .execution_options(synchronize_session=False))
+
+def reconcile_user_stats():
+    # add missing rows (e.g. users from import-data), then repair drifted counters;
+    # run after reconcile_counters, since likes_received sums post like counts
+    db.session.execute(UserStats.__table__.insert().from_select(
+        ['user_id'], select(User.id).where(User.id.not_in(select(UserStats.user_id)))))
+    actual = {
+        'post_count': select(func.count(Post.id)).where(Post.author_id == UserStats.user_id),
+        'likes_received': select(func.coalesce(func.sum(Post.like_count), 0)).where(Post.author_id == UserStats.user_id),
+        'comment_count': select(func.count(Comment.id)).where(Comment.author_id == UserStats.user_id),
+        'likes_given': select(func.count(Like.id)).where(Like.user_id == UserStats.user_id),
+    }
+    actual = {name: query.scalar_subquery() for name, query in actual.items()}
+    repaired = (UserStats.query
+                .filter(or_(*(getattr(UserStats, name) != value for name, value in actual.items())))
+                .update(actual, synchronize_session=False))
+    db.session.commit()
+    return repaired
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Repair drift in the denormalized post and user counters."""
+    print(f'Repaired counters on {reconcile_counters()} posts')
+    print(f'Repaired counters on {reconcile_user_stats()} users')
+
+# Schema migrations (see migrations.py)
+def upgrade_db():
+    with app.app_context():
+        return migrations.upgrade(db.engine, db.metadata)
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create the schema or apply pending migrations."""
+    applied = upgrade_db()
+    for name in applied:
+        print(f'Applied {name}')
+    if not applied:
+        print('Database is up to date')
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Rebuild the full-text search index from posts and comments."""
+    with db.engine.begin() as connection:
+        search.rebuild_index(connection)
+    print('Search index rebuilt')
+
+# Bulk NDJSON export/import (see bulk.py)
+def bulk_tables():
+    return {'user': User.__table__, 'category': Category.__table__, 'post': Post.__table__,
+            'post_categories': Category.post_categories, 'comment': Comment.__table__, 'like': Like.__table__}
+
+@app.cli.command('export-data')
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--chunk-size', default=10000, show_default=True)
+def export_data_command(path, chunk_size):
+    """Write every user, category, post, comment and like as NDJSON ("-" for stdout)."""
+    with click.open_file(path, 'w', encoding='utf-8') as handle, db.engine.connect() as connection:
+        count = bulk.export_ndjson(connection, bulk_tables(), handle, chunk_size)
+    click.echo(f'Exported {count} records', err=True)
+
+@app.cli.command('import-data')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--checkpoint', help='Progress file; an interrupted import resumes from it.')
+@click.option('--chunk-size', default=10000, show_default=True)
+def import_data_command(path, checkpoint, chunk_size):
+    """Load an NDJSON file written by export-data."""
+    started = time.perf_counter()
+
+    def progress(offset, counts):
+        click.echo(f'\r{offset} bytes, {sum(counts.values())} records', nl=False, err=True)
+
+    # row-by-row upkeep is suspended: the search index is rebuilt and the
+    # counters reconciled once the rows are in
+    if search.available(db.engine):
+        with db.engine.begin() as connection:
+            search.drop_triggers(connection)
+    try:
+        counts, existing, skipped = bulk.import_ndjson(db.engine, bulk_tables(), path, checkpoint, chunk_size, progress)
+    finally:
+        if search.available(db.engine):
+            with db.engine.begin() as connection:
+                search.create_triggers(connection)
+                search.rebuild_index(connection)
+    click.echo(err=True)
+    reconcile_counters()
+    reconcile_user_stats()
+    fragment_cache.clear()
+    category_catalog.invalidate()
+    elapsed = time.perf_counter() - started
+    click.echo('Imported ' + ', '.join(f'{kind}={counts[kind]}' for kind in bulk.ORDER)
+               + f' in {elapsed:.1f}s ({sum(counts.values()) / max(elapsed, 1e-9):.0f} records/s)')
+    if existing:
+        click.echo(f'{existing} records were already present', err=True)
+    if skipped:
+        click.echo(f'Skipped {skipped} records with unknown authors, posts or types', err=True)
+
+# Fingerprinted, precompressed static files (see assets.py)
+static_assets = assets.StaticAssets()
+static_assets.init_app(app)
+
+@app.cli.command('build-assets')
+@click.option('--clean', is_flag=True, help='Remove earlier builds first.')
+def build_assets_command(clean):
+    """Minify, fingerprint and precompress static files into static/dist."""
+    manifest = assets.build(app.static_folder, app.config['STATIC_BUILD_DIR'], clean)
+    print(f"Built {len(manifest['files'])} files, {len(manifest['encodings'])} precompressed, "
+          f"{len(manifest['srcsets'])} responsive images")
+    if assets.brotli is None:
+        print('brotli is not installed; only gzip copies were written')
+    if assets.Image is None:
+        print('Pillow is not installed; no resized image variants were written')
+
+# Rendered post cards, dropped whenever their post changes
+fragment_cache = FragmentCache()
+fragment_cache.init_app(app)
+
+@post_changed.connect
+@post_deleted.connect
+def drop_post_fragments(sender, post_id):
+    fragment_cache.invalidate(post_id)
+
+@posts_changed.connect
+def drop_posts_fragments(sender, post_ids):
+    for post_id in post_ids:
+        fragment_cache.invalidate(post_id)
+
+# Categories and their post counts (see category_catalog.py)
+def load_categories():
+    counts = (select(Category.post_categories.c.category_id, func.count().label('post_count'))
+              .group_by(Category.post_categories.c.category_id).subquery())
+    return db.session.execute(
+        select(Category.id, Category.name, func.coalesce(counts.c.post_count, 0))
+        .outerjoin(counts, counts.c.category_id == Category.id)).all()
+
+category_catalog = CategoryCatalog()
+category_catalog.init_app(app, load_categories)
+
+@category_counts_changed.connect
+def adjust_category_counts(sender, deltas):
+    category_catalog.adjust(deltas)
+
+@category_added.connect
+def add_catalog_category(sender, category):
+    category_catalog.add(category.id, category.name)
+
+# Trending posts (see trending.py)
+LIKE_WEIGHT = 1
+COMMENT_WEIGHT = 2
+TRENDING_PER_PAGE = 12
+# log2 sums are added in SQL through ln() and exp()
+LN2 = math.log(2)
+
+def load_trending(limit):
+    with app.app_context():
+        return db.session.execute(
+            select(TrendingScore.post_id, TrendingScore.score).order_by(TrendingScore.score.desc()).limit(limit)).all()
+
+def save_trending(sums, forget_below):
+    # adds log2 sums onto the stored ones in one upsert; posts deleted meanwhile are skipped.
+    # The sum is worked out by the database (trending.add_log2 in SQL), so workers
+    # saving the same post at once each add theirs instead of overwriting the other's
+    with app.app_context():
+        postgres = db.engine.dialect.name == 'postgresql'
+        insert = postgresql.insert if postgres else sqlite.insert
+        greatest, least = (func.greatest, func.least) if postgres else (func.max, func.min)
+        post_ids = list(sums)
+        for start in range(0, len(post_ids), LIKE_INSERT_CHUNK):
+            chunk = post_ids[start:start + LIKE_INSERT_CHUNK]
+            existing = db.session.scalars(select(Post.id).where(Post.id.in_(chunk))).all()
+            rows = [{'post_id': post_id, 'score': sums[post_id]} for post_id in existing]
+            if rows:
+                statement = insert(TrendingScore).values(rows)
+                high = greatest(TrendingScore.score, statement.excluded.score)
+                low = least(TrendingScore.score, statement.excluded.score)
+                db.session.execute(statement.on_conflict_do_update(
+                    index_elements=['post_id'],
+                    set_={'score': high + func.ln(1 + func.exp((low - high) * LN2)) / LN2}))
+        db.session.execute(delete(TrendingScore).where(TrendingScore.score < forget_below))
+        db.session.commit()
+
+trending_index = TrendingIndex()
+trending_index.init_app(app, load_trending, save_trending)
+
+@likes_added.connect
+def rank_likes(sender, counts):
+    for post_id, count in counts.items():
+        trending_index.record(post_id, LIKE_WEIGHT * count)
+
+@comment_added.connect
+def rank_comment(sender, post_id, comment):
+    trending_index.record(post_id, COMMENT_WEIGHT)
+
+@post_deleted.connect
+def unrank_post(sender, post_id):
+    trending_index.remove(post_id)
+
+@app.cli.command('rebuild-trending')
+def rebuild_trending_command():
+    """Recompute trending scores from existing comments and likes."""
+    # likes carry no timestamp, so they count as of their post's creation
+    sums = {}
+
+    def add(post_id, weight, created_at):
+        score = math.log2(weight) + trending_index.now(calendar.timegm(created_at.timetuple()))
+        sums[post_id] = trending.add_log2(sums.get(post_id), score)
+
+    for post_id, created_at, likes in db.session.execute(
+            select(Post.id, Post.created_at, Post.like_count).where(Post.like_count > 0)):
+        add(post_id, LIKE_WEIGHT * likes, created_at)
+    for post_id, created_at in db.session.execute(select(Comment.post_id, Comment.created_at)):
+        add(post_id, COMMENT_WEIGHT, created_at)
+    db.session.execute(delete(TrendingScore))
+    db.session.commit()
+    save_trending(sums, trending_index.now() - trending.FORGET_AFTER)
+    print(f'Ranked {db.session.scalar(select(func.count()).select_from(TrendingScore))} posts')
+
+# Live updates: each page joins one room per post it shows and gets
+# compact events when those posts' counters or comments change
+MAX_ROOMS_PER_CLIENT = 100
+
+def post_room(post_id):
+    return f'post:{post_id}'
+
+def room_ids(post_ids):
+    try:
+        return [int(post_id) for post_id in list(post_ids)[:MAX_ROOMS_PER_CLIENT]]
+    except (TypeError, ValueError):
+        return []
+
+@socketio.on('join_posts')
+def join_posts(post_ids):
+    for post_id in room_ids(post_ids):
+        join_room(post_room(post_id))
+
+@socketio.on('leave_posts')
+def leave_posts(post_ids):
+    for post_id in room_ids(post_ids):
+        leave_room(post_room(post_id))
+
+def live():
+    # false outside a serving process, where nobody could be listening
+    return socketio.server is not None
+
+@post_changed.connect
+def broadcast_post_stats(sender, post_id):
+    if not live():
+        return
+    counts = db.session.query(Post.like_count, Post.comment_count).filter_by(id=post_id).first()
+    if counts:
+        socketio.emit('post_stats', {'post_id': post_id, 'likes': counts.like_count, 'comments': counts.comment_count},
+                      to=post_room(post_id))
+
+@posts_changed.connect
+def broadcast_posts_stats(sender, post_ids, chunk=500):
+    if not live():
+        return
+    post_ids = list(post_ids)
+    for start in range(0, len(post_ids), chunk):
+        for row in db.session.query(Post.id, Post.like_count, Post.comment_count).filter(
+                Post.id.in_(post_ids[start:start + chunk])):
+            socketio.emit('post_stats', {'post_id': row.id, 'likes': row.like_count, 'comments': row.comment_count},
+                          to=post_room(row.id))
+
+@post_deleted.connect
+def broadcast_post_deleted(sender, post_id):
+    if live():
+        socketio.emit('post_deleted', {'post_id': post_id}, to=post_room(post_id))
+
+@comment_added.connect
+def broadcast_comment_added(sender, post_id, comment):
+    if live():
+        socketio.emit('comment_added', {'post_id': post_id, 'id': comment.id, 'author_id': comment.author_id,
+                                        'author': comment.author.username, 'content': comment.content},
+                      to=post_room(post_id))
+
+@comment_deleted.connect
+def broadcast_comment_deleted(sender, post_id, comment_id):
+    if live():
+        socketio.emit('comment_deleted', {'post_id': post_id, 'id': comment_id}, to=post_room(post_id))
+
+# Write-behind likes (see like_buffer.py)
+LIKE_INSERT_CHUNK = 500
+
+def write_likes(pairs):
+    # one transaction per batch: INSERT ... ON CONFLICT DO NOTHING against unique_like,
+    # RETURNING tells which likes were new so the counters move by exactly that much
+    added = Counter()
+    with app.app_context():
+        insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+        post_ids = {post_id for _, post_id in pairs}
+        user_ids = {user_id for user_id, _ in pairs}
+        # posts and users may have been deleted since the like was queued
+        authors = dict(db.session.query(Post.id, Post.author_id).filter(Post.id.in_(post_ids)))
+        users = {user_id for (user_id,) in db.session.query(User.id).filter(User.id.in_(user_ids))}
+        rows = [{'user_id': user_id, 'post_id': post_id} for user_id, post_id in pairs
+                if post_id in authors and user_id in users]
+        given = Counter()
+        for start in range(0, len(rows), LIKE_INSERT_CHUNK):
+            statement = (insert(Like).values(rows[start:start + LIKE_INSERT_CHUNK])
+                         .on_conflict_do_nothing(index_elements=['user_id', 'post_id'])
+                         .returning(Like.user_id, Like.post_id))
+            for user_id, post_id in db.session.execute(statement):
+                added[post_id] += 1
+                given[user_id] += 1
+        for post_id, count in added.items():
+            bump_counter(post_id, Post.like_count, count)
+        received = Counter()
+        for post_id, count in added.items():
+            received[authors[post_id]] += count
+        for user_id, count in received.items():
+            bump_user_stats(user_id, UserStats.likes_received, count)
+        for user_id, count in given.items():
+            bump_user_stats(user_id, UserStats.likes_given, count)
+        db.session.commit()
+        for post_id in added:
+            post_changed.send(app, post_id=post_id)
+        if added:
+            likes_added.send(app, counts=added)
+    return sum(added.values())
+
+like_buffer = LikeBuffer()
+like_buffer.init_app(app, write_likes)
+
+password_policy = PasswordPolicy()
+password_policy.init_app(app)
+
+# Logged-in users, dropped from this worker's cache whenever their row changes here;
+# copies in other workers live out their IDENTITY_CACHE_TTL
+identity_cache = IdentityCache()
+identity_cache.init_app(app)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def drop_cached_identity(mapper, connection, user):
+    identity_cache.invalidate(user.id)
+
+def detached_copy(user):
+    # a copy that outlives the request's session and is never expired by its commits
+    copy = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+    make_transient_to_detached(copy)
+    return copy
+
+# Deletes are set-based; ON DELETE CASCADE (migration 7) removes what hangs off
+# a user or post, so only the denormalized counts need adjusting by hand
+def delete_posts(condition):
+    # returns the deleted ids and the category count changes; call commit() after
+    links = Category.post_categories
+    post_ids = db.session.scalars(select(Post.id).where(condition)).all()
+    deltas = {category_id: -count for category_id, count in db.session.execute(
+        select(links.c.category_id, func.count())
+        .join(Post, Post.id == links.c.post_id).where(condition)
+        .group_by(links.c.category_id))}
+    # authors lose the posts and their likes; commenters and likers lose what cascades away
+    shift_user_stats(select(Post.author_id.label('user_id'), func.count().label('post_count'),
+                            func.sum(Post.like_count).label('likes_received'))
+                     .where(condition).group_by(Post.author_id), sign=-1)
+    for column, owner in ((Comment.post_id, Comment.author_id), (Like.post_id, Like.user_id)):
+        counter = 'comment_count' if owner is Comment.author_id else 'likes_given'
+        shift_user_stats(select(owner.label('user_id'), func.count().label(counter))
+                         .join(Post, Post.id == column).where(condition).group_by(owner), sign=-1)
+    db.session.execute(delete(Post).where(condition).execution_options(synchronize_session=False))
+    return post_ids, deltas
+
+def release_activity(user_id):
+    # take a user's likes and comments off the counters of other people's posts; returns their ids.
+    # Counts are grouped once per table and joined in (UPDATE ... FROM), never counted per post.
+    shift_user_stats(select(Post.author_id.label('user_id'), func.count().label('likes_received'))
+                     .join(Like, Like.post_id == Post.id)
+                     .where(Like.user_id == user_id, Post.author_id != user_id).group_by(Post.author_id), sign=-1)
+    post_ids = set()
+    for column, owner, counter in ((Like.post_id, Like.user_id, Post.like_count),
+                                   (Comment.post_id, Comment.author_id, Post.comment_count)):
+        counts = (select(column.label('post_id'), func.count().label('n'))
+                  .where(owner == user_id).group_by(column).subquery())
+        post_ids.update(db.session.scalars(
+            update(Post).where(Post.id == counts.c.post_id, Post.author_id != user_id)
+            .values({counter: counter - counts.c.n, Post.version: Post.version + 1})
+            .returning(Post.id).execution_options(synchronize_session=False)))
+    return post_ids
+
+def announce_deletes(changed, deleted, deltas):
+    if changed:
+        posts_changed.send(app, post_ids=changed)
+    for post_id in deleted:
+        post_deleted.send(app, post_id=post_id)
+    if deltas:
+        category_counts_changed.send(app, deltas=deltas)
+
+def account_size(user_id):
+    return sum(db.session.scalar(select(func.count()).where(column == user_id))
+               for column in (Post.author_id, Comment.author_id, Like.user_id))
+
+def delete_account_now(user_id):
+    # one transaction: fix up counters elsewhere, then one DELETE that cascades
+    changed = release_activity(user_id)
+    deleted, deltas = delete_posts(Post.author_id == user_id)
+    db.session.execute(delete(User).where(User.id == user_id).execution_options(synchronize_session=False))
+    db.session.commit()
+    identity_cache.invalidate(user_id)
+    announce_deletes(changed, deleted, deltas)
+
+def delete_account_chunk(user_id, size):
+    # one background step: a chunk of comments, then likes, then posts, and the user row last
+    with app.app_context():
+        for model, column in ((Comment, Comment.author_id), (Like, Like.user_id)):
+            ids = db.session.scalars(select(model.id).where(column == user_id).limit(size)).all()
+            if ids:
+                # grouped once and joined in, like release_activity
+                counter = Post.comment_count if model is Comment else Post.like_count
+                counts = (select(model.post_id.label('post_id'), func.count().label('n'))
+                          .where(model.id.in_(ids)).group_by(model.post_id).subquery())
+                changed = db.session.scalars(
+                    update(Post).where(Post.id == counts.c.post_id)
+                    .values({counter: counter - counts.c.n, Post.version: Post.version + 1})
+                    .returning(Post.id).execution_options(synchronize_session=False)).all()
+                if model is Like:
+                    shift_user_stats(select(Post.author_id.label('user_id'), func.count().label('likes_received'))
+                                     .join(Like, Like.post_id == Post.id).where(Like.id.in_(ids))
+                                     .group_by(Post.author_id), sign=-1)
+                db.session.execute(delete(model).where(model.id.in_(ids)).execution_options(synchronize_session=False))
+                db.session.commit()
+                announce_deletes(changed, [], {})
+                return len(ids)
+        ids = db.session.scalars(select(Post.id).where(Post.author_id == user_id).limit(size)).all()
+        if ids:
+            deleted, deltas = delete_posts(Post.id.in_(ids))
+            db.session.commit()
+            announce_deletes([], deleted, deltas)
+            return len(ids)
+        db.session.execute(delete(User).where(User.id == user_id).execution_options(synchronize_session=False))
+        db.session.commit()
+        identity_cache.invalidate(user_id)
+        return 0
+
+def claim_account_deletion(job_id, runner, lease):
+    # one conditional UPDATE, so of the workers trying only one gets the job
+    with app.app_context():
+        now = datetime.utcnow()
+        claimed = db.session.execute(
+            update(AccountDeletion)
+            .where(AccountDeletion.id == job_id,
+                   or_(AccountDeletion.state.in_(('queued', 'failed')),
+                       and_(AccountDeletion.state == 'running',
+                            AccountDeletion.touched_at < now - timedelta(seconds=lease))))
+            .values(state='running', runner=runner, touched_at=now,
+                    started_at=func.coalesce(AccountDeletion.started_at, now))
+            .execution_options(synchronize_session=False))
+        db.session.commit()
+        if claimed.rowcount != 1:
+            return None
+        job = db.session.get(AccountDeletion, job_id)
+        return {'user_id': job.user_id, 'deleted': job.deleted}
+
+def save_account_deletion(job_id, runner, changes):
+    with app.app_context():
+        values = dict(changes, touched_at=datetime.utcnow())
+        if changes.get('state') in ('done', 'failed'):
+            values['finished_at'] = values['touched_at']
+        elif changes.get('state') == 'queued':
+            values['runner'] = None
+        saved = db.session.execute(
+            update(AccountDeletion).where(AccountDeletion.id == job_id, AccountDeletion.runner == runner)
+            .values(values).execution_options(synchronize_session=False))
+        db.session.commit()
+        return saved.rowcount == 1
+
+def unfinished_account_deletions(failed):
+    states = ('queued', 'running', 'failed') if failed else ('queued', 'running')
+    with app.app_context():
+        return db.session.scalars(select(AccountDeletion.id).where(AccountDeletion.state.in_(states))
+                                  .order_by(AccountDeletion.created_at)).all()
+
+def queue_account_deletion(user_id, size):
+    # locks the account (a new hash ends every session) and stores the job in one
+    # commit, so a locked account always has a job that some worker will finish
+    job_id = secrets.token_urlsafe(12)
+    db.session.get(User, user_id).password = '!deleted'
+    db.session.add(AccountDeletion(id=job_id, user_id=user_id, total=size))
+    db.session.commit()
+    account_deletions.submit(job_id)
+    return job_id
+
+account_deletions = DeletionQueue()
+account_deletions.init_app(app, delete_account_chunk, claim_account_deletion, save_account_deletion,
+                           unfinished_account_deletions)
+
+@app.cli.command('resume-account-deletions')
+@click.option('--failed', is_flag=True, help='Also retry deletions that failed.')
+def resume_account_deletions_command(failed):
+    """Finish background account deletions here, in the foreground."""
+    for job_id in unfinished_account_deletions(failed):
+        # a job another worker touched within the lease is left to it
+        print(f"{job_id}: {'done' if account_deletions.run(job_id) else 'skipped'}")
+
+def wants_json():
+    # set by static/js/live.js on likes and comments sent without a page reload
+    return request.accept_mimetypes.best == 'application/json'
+
+# Rate limiting (see rate_limit.py): checked before the view runs, with keys
+# taken from the signed session cookie and the form, so a refused request
+# never reaches the database or the password hasher
+rate_limiter = RateLimiter()
+rate_limiter.init_app(app)
+
+def client_key():
+    # the logged-in user's id as stored by login_user (see User.get_id), else the client address
+    user_id = (session.get('_user_id') or '').partition(':')[0]
+    return f'user:{user_id}' if user_id else f'ip:{request.remote_addr}'
+
+def too_many_requests(retry_after):
+    seconds = math.ceil(retry_after)
+    if wants_json():
+        response = jsonify(error='Too many requests', retry_after=seconds)
+    else:
+        response = make_response(f'Too many requests, try again in {seconds} seconds.')
+    response.status_code = 429
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+@app.before_request
+def throttle():
+    checks = []
+    if request.endpoint in ('like_post', 'add_comment'):
+        checks.append((request.endpoint, client_key()))
+    elif request.endpoint in ('login', 'register') and request.method == 'POST':
+        checks.append((request.endpoint, f'ip:{request.remote_addr}'))
+        if request.endpoint == 'login':
+            # one account guessed at from many addresses
+            checks.append(('login_account', request.form.get('username', '').lower()))
+    for rule, key in checks:
+        retry_after = rate_limiter.hit(rule, key)
+        if retry_after is not None:
+            return too_many_requests(retry_after)
+
+# Conditional GET: pages get a strong ETag over everything they show, and a
+# matching If-None-Match is answered with a 304 before anything is loaded or rendered
+def deploy_fingerprint():
+    # changes when a deploy changes templates or built static files, so old ETags stop matching
+    digest = hashlib.sha256(repr(sorted(static_assets.files.items())).encode())
+    for root, _, names in sorted(os.walk(os.path.join(app.root_path, app.template_folder))):
+        for name in sorted(names):
+            with open(os.path.join(root, name), 'rb') as handle:
+                digest.update(handle.read())
+    return digest.hexdigest()[:16]
+
+DEPLOY_FINGERPRINT = deploy_fingerprint()
+
+def conditional_page(parts, last_modified, render):
+    # parts: everything the page depends on besides the viewer, as cheap stamps.
+    # Only the ETag decides a 304: created_at doesn't move on edits, likes or
+    # comments, so Last-Modified is informational. Pages with flashed messages
+    # are one-offs and never validated.
+    if '_flashes' in session:
+        return render()
+    etag = hashlib.sha256(repr((DEPLOY_FINGERPRINT, current_user.get_id(), parts)).encode()).hexdigest()[:32]
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    # browsers keep the page but check back every time; it differs per session
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+def render_post_cards(posts, page):
+    # one cached card per (post, version, page, owner or not); a warm page is only lookups
+    cards = []
+    for post in posts:
+        owner = post.author_id == current_user.id
+        cards.append(fragment_cache.get_or_render(
+            post.id, (post.version, page, owner),
+            lambda: render_template('_post_card.html', post=post, page=page, owner=owner)))
+    return cards
 
 # admin.add_view(ModelView(User, db.session))
 # admin.add_view(ModelView(Post, db.session))
@@ -102,17 +890,146 @@ def index():
 def handle_message(message):
     print(f'received message: {message}')
 
+# Feed pagination
+POSTS_PER_PAGE = 12
+
+def encode_cursor(created_at, post_id):
+    return f"{created_at:%Y%m%d%H%M%S%f}.{post_id}"
+
+def decode_cursor(cursor):
+    try:
+        created_at, post_id = cursor.split('.')
+        return datetime.strptime(created_at, '%Y%m%d%H%M%S%f'), int(post_id)
+    except (AttributeError, ValueError):
+        return None
+
+def decode_id_cursor(cursor):
+    try:
+        return int(cursor)
+    except (TypeError, ValueError):
+        return None
+
+def feed_seek(query, cursor, per_page, key=None):
+    # Keyset pagination: seek past the last (created_at, id) seen instead of
+    # using OFFSET, so every page is a bounded range scan of ix_post_created_at_id.
+    # With a key (a column holding the post id) the feed pages on that alone and
+    # the cursor is the bare id, for feeds whose index ends in the post id
+    if key is not None:
+        position = decode_id_cursor(cursor)
+        if position:
+            query = query.filter(key < position)
+        return query.order_by(key.desc()).limit(per_page + 1)
+    position = decode_cursor(cursor)
+    if position:
+        query = query.filter(tuple_(Post.created_at, Post.id) < position)
+    return query.order_by(Post.created_at.desc(), Post.id.desc()).limit(per_page + 1)
+
+def feed_page(query, cursor=None, per_page=POSTS_PER_PAGE, key=None):
+    posts = feed_seek(query, cursor, per_page, key).options(selectinload(Post.author)).all()
+    last = posts[per_page - 1] if len(posts) > per_page else None
+    if last is None:
+        next_cursor = None
+    else:
+        next_cursor = str(last.id) if key is not None else encode_cursor(last.created_at, last.id)
+    return posts[:per_page], next_cursor
+
+def feed_validators(query, cursor, per_page=POSTS_PER_PAGE, key=None):
+    # (id, version) of the rows feed_page would load, without loading them
+    rows = feed_seek(query, cursor, per_page, key).with_entities(Post.id, Post.version, Post.created_at).all()
+    return [(row.id, row.version) for row in rows], max((row.created_at for row in rows), default=None)
+
 @app.route('/posts')
 @login_required
 def posts():
-    posts = Post.query.order_by(desc(Post.c.created_at)).all()
+    cursor = request.args.get('before')
+    stamps, last_modified = feed_validators(Post.query, cursor)
+    cloud = category_catalog.cloud()
+
+    def render():
+        posts, next_cursor = feed_page(Post.query, cursor)
+        cards = render_post_cards(posts, 'posts')
+        return render_template('posts.html', cards=cards, user=current_user, cloud=cloud,
+                               next_cursor=next_cursor, cursor=cursor)
+
+    return conditional_page(('posts', cursor, stamps, cloud), last_modified, render)
+
+@app.route('/category/<name>')
+@login_required
+def category_feed(name):
+    # the catalog resolves the name, ix_post_categories_category_id_post_id the posts.
+    # Pages go by post id, newest first, so that index both orders and seeks;
+    # ordering by created_at across the join sorted every post in the category
+    category = category_catalog.get(name)
+    if category is None:
+        abort(404)
+    links = Category.post_categories
+    query = (Post.query.join(links, links.c.post_id == Post.id)
+             .filter(links.c.category_id == category.id))
+    cursor = request.args.get('before')
+    stamps, last_modified = feed_validators(query, cursor, key=links.c.post_id)
+    cloud = category_catalog.cloud()
+
+    def render():
+        posts, next_cursor = feed_page(query, cursor, key=links.c.post_id)
+        cards = render_post_cards(posts, 'posts')
+        return render_template('category.html', category=category, cards=cards, user=current_user,
+                               cloud=cloud, next_cursor=next_cursor, cursor=cursor)
+
+    return conditional_page(('category', category, cursor, stamps, cloud), last_modified, render)
+
+@app.route('/trending')
+@login_required
+def trending_posts():
+    # ranks come from memory; only the cards on the page are loaded
+    ranked = trending_index.top(TRENDING_PER_PAGE)
+    posts = {post.id: post for post in Post.query.options(selectinload(Post.author))
+             .filter(Post.id.in_([post_id for post_id, _ in ranked]))}
+    cards = render_post_cards([posts[post_id] for post_id, _ in ranked if post_id in posts], 'trending_posts')
+    return render_template('trending.html', cards=cards, user=current_user)
+
+# Search
+SEARCH_RESULTS_PER_PAGE = 20
+SEARCH_MAX_PAGE = 50
+
+@app.route('/search')
+@login_required
+def search_results():
+    terms = request.args.get('q', '').strip()
+    page = min(max(request.args.get('page', 1, type=int), 1), SEARCH_MAX_PAGE)
+    hits, has_more, titles = [], False, {}
+    connection = db.session.connection()
+    if terms and not search.available(connection):
+        flash('Search is not available on this database.', category='danger')
+    elif terms:
+        hits, has_more = search.search(connection, terms, page, SEARCH_RESULTS_PER_PAGE)
+        post_ids = {hit['post_id'] for hit in hits}
+        titles = dict(db.session.query(Post.id, Post.title).filter(Post.id.in_(post_ids))) if post_ids else {}
+    return render_template('search.html', user=current_user, terms=terms, hits=hits, titles=titles,
+                           page=page, has_more=has_more and page < SEARCH_MAX_PAGE)
 
-    return render_template('posts.html', posts=posts, user=current_user)
 # Login
 # Flask-Login helper to retrieve a user from the database
 @login_manager.user_loader
-def load_user(user_id):
-    return User.query.get(int(user_id))
+def load_user(session_id):
+    user_id, _, stamp = session_id.partition(':')
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return None
+    cached = identity_cache.get(user_id, stamp)
+    if cached is not None:
+        # attach to this request's session without a SELECT
+        return db.session.merge(cached, load=False)
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    if not stamp:
+        # session from before credential stamps: still valid, just not cached
+        return user
+    if stamp != user.credential_stamp:
+        return None
+    identity_cache.put(user_id, stamp, detached_copy(user))
+    return user
 
 # Register route
 @app.route("/register", methods=["GET", "POST"])
@@ -135,15 +1052,23 @@ def register():
         elif len(password) < 4:
             flash('Password must be longer than 4 character!', category='danger')
         else:
+            try:
+                pwhash = password_policy.hash(password)
+            except PasswordBusy:
+                flash('Server is busy, please try again.', category='danger')
+                return redirect(url_for("register"))
             # Create a new user and add it to the database
-            new_user = User(username=name, email=email, password=generate_password_hash(password, method='sha256'))
+            new_user = User(username=name, email=email, password=pwhash)
             db.session.add(new_user)
+            db.session.flush()
+            db.session.add(UserStats(user_id=new_user.id))
             db.session.commit()
 
             # Log the user in
             login_user(new_user, remember=True)
             flash(f'Wellcome {current_user.username}')
             return redirect(url_for("index", user=current_user))
+        return redirect(url_for("register"))
     else:
         return render_template("register.html", user=current_user)
 
@@ -159,7 +1084,19 @@ def login():
 
         # Log the user in
         if user:
-            if check_password_hash(user.password, password):
+            try:
+                valid = password_policy.verify(user.password, password)
+            except PasswordBusy:
+                flash('Server is busy, please try again.', category='danger')
+                return redirect(url_for("login"))
+            if valid:
+                if password_policy.needs_rehash(user.password):
+                    # upgrade hashes from an older policy while the password is at hand
+                    try:
+                        user.password = password_policy.hash(password)
+                        db.session.commit()
+                    except PasswordBusy:
+                        pass
 
                 login_user(user)
                 flash(f'You are logged as {current_user.username}')
@@ -185,54 +1122,126 @@ def logout():
 @login_required
 def delete_account():
     # Delete the user from the database
-    db.session.delete(current_user)
-    db.session.commit()
+    user_id = current_user.id
+    size = account_size(user_id)
+    if size <= app.config['ACCOUNT_DELETE_SYNC_LIMIT']:
+        delete_account_now(user_id)
+        job_id = None
+    else:
+        job_id = queue_account_deletion(user_id, size)
 
     # Log the user out
     logout_user()
 
-    flash("Wour account is deleted, create new to continue.")
+    if job_id:
+        flash(f"Your account is being deleted, follow along at {url_for('account_deletion', job_id=job_id)}")
+    else:
+        flash("Wour account is deleted, create new to continue.")
     return redirect(url_for('register'))
 
+@app.route('/account_deletion/<job_id>')
+def account_deletion(job_id):
+    # read from the table, so any worker can answer
+    job = db.session.get(AccountDeletion, job_id)
+    if job is None:
+        abort(404)
+    percent = 100.0 if job.state == 'done' or not job.total else min(100.0, 100.0 * job.deleted / job.total)
+    return jsonify(state=job.state, total=job.total, deleted=job.deleted, percent=percent,
+                   started_at=job.started_at and job.started_at.isoformat(),
+                   finished_at=job.finished_at and job.finished_at.isoformat())
+
 # User profile route
+# Profiles: counts come from user_stats, posts a page at a time from
+# ix_post_author_id_created_at_id
 @app.route('/user')
 @login_required
 def user():
-    posts = Post.query.filter_by(author_id=current_user.id).all()
-    return render_template('user.html', user=current_user, posts=posts)
+    return profile_page(current_user)
+
+@app.route('/user/<int:user_id>')
+@login_required
+def user_profile(user_id):
+    profile = db.session.get(User, user_id)
+    if profile is None:
+        abort(404)
+    return profile_page(profile)
+
+def profile_page(profile):
+    stats = db.session.get(UserStats, profile.id) or UserStats(**{name: 0 for name in USER_COUNTERS})
+    counts = tuple(getattr(stats, name) for name in USER_COUNTERS)
+    query = Post.query.filter(Post.author_id == profile.id)
+    cursor = request.args.get('before')
+    stamps, last_modified = feed_validators(query, cursor)
+
+    def render():
+        posts, next_cursor = feed_page(query, cursor)
+        cards = render_post_cards(posts, 'user')
+        return render_template('user.html', user=current_user, profile=profile, stats=stats, cards=cards,
+                               own=profile.id == current_user.id, next_cursor=next_cursor, cursor=cursor)
+
+    return conditional_page(('user', profile.id, profile.username, counts, cursor, stamps), last_modified, render)
 
 @app.route('/new-post', methods=['GET', 'POST'])
 @login_required
 def new_post():
-    categories = Category.query.all()
     if request.method == 'POST':
         title = request.form['title']
         text = request.form['text']
-        category = request.form['category']
+        category = category_catalog.get(request.form['category'])
 
         new_post = Post(title=title, content=text, author_id=current_user.id)
         db.session.add(new_post)
-        category = Category.query.filter_by(name=category).first()
-        new_post.categories.append(category)
+        bump_user_stats(current_user.id, UserStats.post_count, 1)
+        if category:
+            new_post.categories.append(db.session.get(Category, category.id))
         db.session.commit()
+        if category:
+            category_counts_changed.send(app, deltas={category.id: 1})
         return redirect(url_for('posts', user=current_user))
 
 
-    return render_template('new-post.html', user=current_user, categories=categories)
+    return render_template('new-post.html', user=current_user, categories=category_catalog.all())
+
+# Post details
+LIKERS_SHOWN = 10
+COMMENTS_PER_PAGE = 20
 
 @app.route('/post.<int:post_id>')
 def post_details(post_id):
-    post = Post.query.get(post_id)
-    likes = post.likes
-    users = [like.user for like in likes]
-    comments = Comment.query.filter_by(post_id=post_id).all()
-    return render_template('post-details.html', post=post, user=current_user, comments=comments, users=users)
+    # the version changes with every edit, like and comment, which covers everything shown
+    stamp = db.session.query(Post.version, Post.created_at).filter_by(id=post_id).first()
+    if stamp is None:
+        abort(404)
+    after = request.args.get('after', type=int)
+    return conditional_page(('post', post_id, stamp.version, after), stamp.created_at,
+                            lambda: render_post_details(post_id, after))
+
+def render_post_details(post_id, after):
+    # three queries however many likes or comments the post has:
+    # the post with its author and categories, the latest likers, one page of comments
+    post = (Post.query
+            .options(joinedload(Post.author), joinedload(Post.categories))
+            .filter_by(id=post_id)
+            .first_or_404())
+    users = (User.query
+             .join(Like, Like.user_id == User.id)
+             .filter(Like.post_id == post_id)
+             .order_by(Like.id.desc())
+             .limit(LIKERS_SHOWN)
+             .all())
+    comments = Comment.query.options(joinedload(Comment.author)).filter_by(post_id=post_id)
+    if after:
+        comments = comments.filter(Comment.id > after)
+    comments = comments.order_by(Comment.id).limit(COMMENTS_PER_PAGE + 1).all()
+    next_after = comments[COMMENTS_PER_PAGE - 1].id if len(comments) > COMMENTS_PER_PAGE else None
+    return render_template('post-details.html', post=post, user=current_user, comments=comments[:COMMENTS_PER_PAGE],
+                           users=users, next_after=next_after, after=after)
 
 @app.route('/delete_post.<int:post_id>')
 def delete_post(post_id):
-    post = Post.query.get(post_id)
-    db.session.delete(post)
+    deleted, deltas = delete_posts(Post.id == post_id)
     db.session.commit()
+    announce_deletes([], deleted, deltas)
     return redirect('posts')
 
 @app.route('/update_post.<int:post_id>/<string:page>', methods=['GET', 'POST'])
@@ -243,36 +1252,35 @@ def update_post(post_id, page):
         text = request.form['text']
         category = request.form['category']
 
-        category = Category.query.filter_by(name=category).first()
+        category = category_catalog.get(category)
 
         post = Post.query.get(id)
 
-        post.categories.append(category)
+        tagged = category and category.id not in {c.id for c in post.categories}
+        if tagged:
+            post.categories.append(db.session.get(Category, category.id))
         post.title = title
         post.content = text
+        post.version = Post.version + 1
         # post.categories = category
         db.session.commit()
+        post_changed.send(app, post_id=post.id)
+        if tagged:
+            category_counts_changed.send(app, deltas={category.id: 1})
         if page == 'post_details':
             return redirect(url_for('post_details', post_id=post_id))
         else:
             return redirect(url_for(page))
 
     post = Post.query.get(post_id)
-    categories = Category.query.all()
-    return render_template('update.html', post=post,user=current_user, categories=categories)
+    return render_template('update.html', post=post,user=current_user, categories=category_catalog.all())
 
 @app.route('/like_post.<int:post_id>/<string:page>', methods=['GET', 'POST'])
 def like_post(post_id, page):
-    user_id = current_user.id
-    existing_like = Like.query.filter_by(user_id=user_id, post_id=post_id).first()
-    if existing_like:
-        if page == 'post_details':
-            return redirect(url_for('post_details', post_id=post_id))
-        else:
-            return redirect(url_for(page))
-    new_like = Like(user_id=user_id, post_id=post_id)
-    db.session.add(new_like)
-    db.session.commit()
+    # queued, not written: the flush updates the counter and broadcasts post_stats
+    like_buffer.add(current_user.id, post_id)
+    if wants_json():
+        return jsonify(post_id=post_id, queued=True), 202
     if page == 'post_details':
         return redirect(url_for('post_details', post_id=post_id))
     else:
@@ -285,7 +1293,15 @@ def add_comment(post_id):
     if content:
         new_comment = Comment(content=content, author_id=current_user.id, post_id=post_id)
         db.session.add(new_comment)
+        bump_counter(post_id, Post.comment_count, 1)
+        bump_user_stats(current_user.id, UserStats.comment_count, 1)
         db.session.commit()
+        post_changed.send(app, post_id=post_id)
+        comment_added.send(app, post_id=post_id, comment=new_comment)
+        if wants_json():
+            return jsonify(post_id=post_id, comment_id=new_comment.id), 201
+    elif wants_json():
+        return jsonify(error='Comment is empty'), 400
     return redirect(url_for('post_details', post_id=post.id))
 
 @app.route('/update_comment.<int:comment_id>')
@@ -299,7 +1315,11 @@ def delete_comment(comment_id):
     comment = Comment.query.get(comment_id)
     post = Post.query.get(comment.post_id)
     db.session.delete(comment)
+    bump_counter(post.id, Post.comment_count, -1)
+    bump_user_stats(comment.author_id, UserStats.comment_count, -1)
     db.session.commit()
+    post_changed.send(app, post_id=post.id)
+    comment_deleted.send(app, post_id=post.id, comment_id=comment_id)
     return redirect(url_for('post_details', post_id=post.id))
 
 @app.route('/new_caregory', methods=['GET', 'POST'])
@@ -310,9 +1330,162 @@ def new_category():
             new_category = Category(name=category_name)
             db.session.add(new_category)
             db.session.commit()
+            category_added.send(app, category=new_category)
 
     return redirect(url_for('index'))
 
+# JSON API (see api.py): every response takes a fixed number of queries,
+# however many rows or includes it returns
+api.init_app(app)
+
+API_POST_FIELDS = {'id': Post.id, 'title': Post.title, 'content': Post.content,
+                   'created_at': Post.created_at, 'author_id': Post.author_id}
+API_POST_INCLUDES = ('author', 'categories', 'counts')
+API_COMMENT_FIELDS = {'id': Comment.id, 'post_id': Comment.post_id, 'content': Comment.content,
+                      'created_at': Comment.created_at, 'author_id': Comment.author_id}
+API_LIKE_FIELDS = {'id': Like.id, 'post_id': Like.post_id, 'user_id': Like.user_id}
+API_CATEGORY_FIELDS = ('id', 'name', 'post_count')
+
+def api_authors(user_ids):
+    # one query for every author on the page, each serialized once
+    return {user_id: {'id': user_id, 'username': username} for user_id, username in
+            db.session.execute(select(User.id, User.username).where(User.id.in_(user_ids)))} if user_ids else {}
+
+def api_posts(rows, fields, include):
+    # rows: the requested field columns followed by id, author_id, like_count and comment_count
+    width = len(fields)
+    authors = api_authors({row[width + 1] for row in rows}) if 'author' in include else {}
+    categories = {}
+    if 'categories' in include and rows:
+        links = Category.post_categories
+        entries = category_catalog.by_ids()
+        for post_id, category_id in db.session.execute(
+                select(links.c.post_id, links.c.category_id).where(links.c.post_id.in_([row[width] for row in rows]))):
+            entry = entries.get(category_id)
+            if entry is not None:
+                categories.setdefault(post_id, []).append({'id': entry.id, 'name': entry.name})
+    data = []
+    for row in rows:
+        item = dict(zip(fields, row))
+        if 'author' in include:
+            item['author'] = authors.get(row[width + 1])
+        if 'categories' in include:
+            item['categories'] = categories.get(row[width], [])
+        if 'counts' in include:
+            item['counts'] = {'likes': row[width + 2], 'comments': row[width + 3]}
+        data.append(item)
+    return data
+
+def api_post_columns(fields):
+    return [API_POST_FIELDS[field] for field in fields] + [Post.id, Post.author_id, Post.like_count,
+                                                            Post.comment_count]
+
+@app.route('/api/v1/posts')
+@api.login_required
+def api_post_list():
+    # newest first; ?category=<name> and ?author=<user id> narrow it down, ?before=<cursor> pages
+    fields = api.requested('fields', tuple(API_POST_FIELDS), tuple(API_POST_FIELDS))
+    include = api.requested('include', API_POST_INCLUDES, ())
+    per_page, cursor = api.page_size(), request.args.get('before')
+    query = Post.query
+    if request.args.get('category'):
+        category = category_catalog.get(request.args['category'])
+        if category is None:
+            raise api.ApiError(404, 'no such category')
+        links = Category.post_categories
+        query = query.join(links, links.c.post_id == Post.id).filter(links.c.category_id == category.id)
+    if request.args.get('author'):
+        author_id = request.args.get('author', type=int)
+        if author_id is None:
+            raise api.ApiError(400, 'author must be a user id')
+        query = query.filter(Post.author_id == author_id)
+    # post versions move with every edit, like, comment and tagging, so they cover the whole page
+    stamps, _ = feed_validators(query, cursor, per_page)
+    etag = api.validator('posts', request.query_string, stamps)
+    unchanged = api.not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    rows = feed_seek(query, cursor, per_page).with_entities(*api_post_columns(fields), Post.created_at).all()
+    last = rows[per_page - 1] if len(rows) > per_page else None
+    next_cursor = encode_cursor(last[-1], last[len(fields)]) if last else None
+    rows = [row[:-1] for row in rows[:per_page]]
+    return api.respond({'data': api_posts(rows, fields, include), 'next': api.next_link('before', next_cursor)}, etag)
+
+@app.route('/api/v1/posts/<int:post_id>')
+@api.login_required
+def api_post(post_id):
+    fields = api.requested('fields', tuple(API_POST_FIELDS), tuple(API_POST_FIELDS))
+    include = api.requested('include', API_POST_INCLUDES, ())
+    version = db.session.scalar(select(Post.version).where(Post.id == post_id))
+    if version is None:
+        raise api.ApiError(404, 'no such post')
+    etag = api.validator('post', post_id, version, request.query_string)
+    unchanged = api.not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    rows = db.session.execute(select(*api_post_columns(fields)).where(Post.id == post_id)).all()
+    return api.respond({'data': api_posts(rows, fields, include)[0]}, etag)
+
+def api_require_post(post_id):
+    if db.session.scalar(select(Post.id).where(Post.id == post_id)) is None:
+        raise api.ApiError(404, 'no such post')
+
+@app.route('/api/v1/posts/<int:post_id>/comments')
+@api.login_required
+def api_comments(post_id):
+    # oldest first, ?after=<comment id> pages
+    fields = api.requested('fields', tuple(API_COMMENT_FIELDS), tuple(API_COMMENT_FIELDS))
+    include = api.requested('include', ('author',), ())
+    per_page = api.page_size()
+    api_require_post(post_id)
+    statement = (select(*(API_COMMENT_FIELDS[field] for field in fields), Comment.id, Comment.author_id)
+                 .where(Comment.post_id == post_id).order_by(Comment.id).limit(per_page + 1))
+    if request.args.get('after', type=int):
+        statement = statement.where(Comment.id > request.args.get('after', type=int))
+    rows = db.session.execute(statement).all()
+    next_after = rows[per_page - 1][-2] if len(rows) > per_page else None
+    rows = rows[:per_page]
+    authors = api_authors({row[-1] for row in rows}) if include else {}
+    data = []
+    for row in rows:
+        item = dict(zip(fields, row))
+        if include:
+            item['author'] = authors.get(row[-1])
+        data.append(item)
+    return api.respond({'data': data, 'next': api.next_link('after', next_after)})
+
+@app.route('/api/v1/posts/<int:post_id>/likes')
+@api.login_required
+def api_likes(post_id):
+    # newest first, ?before=<like id> pages
+    fields = api.requested('fields', tuple(API_LIKE_FIELDS), tuple(API_LIKE_FIELDS))
+    include = api.requested('include', ('user',), ())
+    per_page = api.page_size()
+    api_require_post(post_id)
+    statement = (select(*(API_LIKE_FIELDS[field] for field in fields), Like.id, Like.user_id)
+                 .where(Like.post_id == post_id).order_by(Like.id.desc()).limit(per_page + 1))
+    if request.args.get('before', type=int):
+        statement = statement.where(Like.id < request.args.get('before', type=int))
+    rows = db.session.execute(statement).all()
+    next_before = rows[per_page - 1][-2] if len(rows) > per_page else None
+    rows = rows[:per_page]
+    users = api_authors({row[-1] for row in rows}) if include else {}
+    data = []
+    for row in rows:
+        item = dict(zip(fields, row))
+        if include:
+            item['user'] = users.get(row[-1])
+        data.append(item)
+    return api.respond({'data': data, 'next': api.next_link('before', next_before)})
+
+@app.route('/api/v1/categories')
+@api.login_required
+def api_categories():
+    # straight from the category catalog, no queries
+    fields = api.requested('fields', API_CATEGORY_FIELDS, API_CATEGORY_FIELDS)
+    return api.respond({'data': [{field: getattr(entry, field) for field in fields}
+                                 for entry in category_catalog.all()]})
+
 # Protected route
 @app.route("/protected")
 @login_required
@@ -320,7 +1493,74 @@ def protected():
     return "Logged in as: " + current_user.username
 # Login
 
+# Serving (see wsgi.py and gunicorn.conf.py)
+def init_admin():
+    from flask_admin import Admin
+    from admin_views import ProfilerView, MetricsView
+    admin = Admin(app)
+    admin.add_view(ProfilerView(profiler, app.config['ADMIN_USERNAMES'], name='Profiler', endpoint='profiler'))
+    admin.add_view(MetricsView({'Process': process_stats,
+                                'Write-behind likes': like_buffer.stats, 'Post card cache': fragment_cache.stats,
+                                'Identity cache': identity_cache.stats,
+                                'Category catalog': category_catalog.stats,
+                                'Account deletions': account_deletions.stats,
+                                'Trending': trending_index.stats,
+                                'Rate limits': rate_limiter.stats},
+                               app.config['ADMIN_USERNAMES'], name='Metrics', endpoint='metrics'))
+
+def create_app():
+    # attaches what only a serving process needs and warms the shared caches;
+    # safe to call again, and to fork after (workers reopen connections and
+    # restart background threads on their own)
+    global startup_seconds
+    if socketio.server is None:
+        socketio.init_app(app, message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'])
+        if app.config['ADMIN_ENABLED']:
+            init_admin()
+        if app.config['WARM_START']:
+            with app.app_context():
+                category_catalog.all()
+                trending_index.warm()
+                db.session.remove()
+                db.engine.dispose()
+        startup_seconds = time.perf_counter() - BOOT_STARTED
+    return app
+
+startup_seconds = None
+schema_current = False
+
+def process_stats():
+    return {
+        'pid': os.getpid(),
+        'rss_mb': round(serving.rss_bytes() / 2 ** 20, 1),
+        'startup_seconds': round(startup_seconds or 0, 3),
+        'threads': serving.thread_count(),
+    }
+
+@app.route('/readyz')
+def readyz():
+    # for load balancers and deploy checks: 200 once the database answers and
+    # has every migration applied, 503 until then
+    global schema_current
+    checks = {'database': 'ok', 'migrations': 'ok'}
+    try:
+        db.session.execute(select(1))
+        # once current, it stays current for the life of the process
+        schema_current = schema_current or not migrations.pending(db.engine)
+        if not schema_current:
+            checks['migrations'] = 'pending'
+    except SQLAlchemyError:
+        checks = {'database': 'unavailable', 'migrations': 'unknown'}
+    ready = all(check == 'ok' for check in checks.values())
+    response = jsonify(ready=ready, checks=checks)
+    response.status_code = 200 if ready else 503
+    response.cache_control.no_store = True
+    return response
+
 if __name__ == '__main__':
+    create_app()
+    upgrade_db()
+    account_deletions.start()
     socketio.run(app)
 
 lorem = 'Lorem, ipsum dolor sit amet consectetur adipisicing elit. Dignissimos libero minus provident dolore dolorem laboriosam eligendi veniam nam sequi, sit et recusandae inventore eaque optio esse rerum? Aut odio voluptas, provident tempore iusto doloribus? Magnam illo sequi laborum excepturi dolor.'
\ No newline at end of file
@@ -0,0 +1,178 @@
+# Static asset build and serving
+#
+# `flask build-assets` minifies CSS/JS, names every file after a hash of its
+# content, writes gzip (and brotli, if installed) copies of text assets and,
+# with Pillow installed, resized variants of the banner images. Everything
+# lands in static/dist with a manifest.json. When the manifest exists,
+# url_for('static', ...) points at the hashed files, which are served with a
+# year-long immutable Cache-Control and in the best encoding the client takes.
+import fnmatch
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:  # optional: no .br files without it
+    brotli = None
+try:
+    from PIL import Image
+except ImportError:  # optional: no resized image variants without it
+    Image = None
+
+SOURCES = ('css', 'js', 'images')
+COMPRESSIBLE = ('.css', '.js', '.svg')
+# banners get resized variants for srcset, at these widths
+RESPONSIVE = ('images/ban*.jpg', 'images/bg.jpg')
+RESPONSIVE_WIDTHS = (480, 960, 1600)
+JPEG_QUALITY = 80
+ONE_YEAR = 365 * 24 * 3600
+
+CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|(/\*.*?\*/)|\s*([{};,])\s*|(\s+)''', re.S)
+
+
+def minify_css(source):
+    # drops comments (keeping /*! licences) and whitespace; strings are left alone
+    def replace(match):
+        string, comment, punctuation, space = match.groups()
+        if string:
+            return string
+        if comment:
+            return comment if comment.startswith('/*!') else ''
+        if punctuation:
+            return punctuation
+        return ' '
+    return CSS_TOKENS.sub(replace, source).strip()
+
+
+def minify_js(source):
+    # whole-line comments, indentation and blank lines only; never rewrites code
+    lines = (line.strip() for line in source.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//')) + '\n'
+
+
+def hashed_name(path, content):
+    root, ext = os.path.splitext(path)
+    return f'{root}.{hashlib.sha256(content).hexdigest()[:12]}{ext}'
+
+
+def resized(content, width):
+    image = Image.open(io.BytesIO(content))
+    if image.width <= width:
+        return None
+    image = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+    out = io.BytesIO()
+    image.convert('RGB').save(out, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def build(static_folder, out='dist', clean=False):
+    # returns the manifest; paths in it are relative to static_folder
+    target = os.path.join(static_folder, out)
+    if clean and os.path.isdir(target):
+        shutil.rmtree(target)
+    manifest = {'files': {}, 'encodings': {}, 'srcsets': {}}
+
+    def emit(logical, content):
+        built = f'{out}/{hashed_name(logical, content)}'
+        path = os.path.join(static_folder, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as handle:
+            handle.write(content)
+        manifest['files'][logical] = built
+        if logical.endswith(COMPRESSIBLE):
+            encodings = []
+            with open(path + '.gz', 'wb') as handle:
+                handle.write(gzip.compress(content, 9, mtime=0))
+            encodings.append('gzip')
+            if brotli is not None:
+                with open(path + '.br', 'wb') as handle:
+                    handle.write(brotli.compress(content, quality=11))
+                encodings.insert(0, 'br')
+            manifest['encodings'][built] = encodings
+
+    for directory in SOURCES:
+        for root, _, names in os.walk(os.path.join(static_folder, directory)):
+            for name in sorted(names):
+                logical = os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, '/')
+                with open(os.path.join(static_folder, logical), 'rb') as handle:
+                    content = handle.read()
+                if logical.endswith('.css'):
+                    content = minify_css(content.decode('utf-8')).encode('utf-8')
+                elif logical.endswith('.js'):
+                    content = minify_js(content.decode('utf-8')).encode('utf-8')
+                emit(logical, content)
+
+                if Image is not None and any(fnmatch.fnmatch(logical, pattern) for pattern in RESPONSIVE):
+                    srcset = []
+                    for width in RESPONSIVE_WIDTHS:
+                        variant = resized(content, width)
+                        if variant is not None:
+                            root_name, ext = os.path.splitext(logical)
+                            emit(f'{root_name}-{width}w{ext}', variant)
+                            srcset.append([width, f'{root_name}-{width}w{ext}'])
+                    if srcset:
+                        srcset.append([Image.open(io.BytesIO(content)).width, logical])
+                        manifest['srcsets'][logical] = srcset
+
+    os.makedirs(target, exist_ok=True)
+    with open(os.path.join(target, 'manifest.json'), 'w') as handle:
+        json.dump(manifest, handle, indent=1, sort_keys=True)
+    return manifest
+
+
+class StaticAssets:
+    def __init__(self):
+        self.files = {}
+        self.encodings = {}
+        self.srcsets = {}
+        self.immutable = set()
+        self.app = None
+
+    def init_app(self, app):
+        self.app = app
+        path = os.path.join(app.static_folder, app.config.get('STATIC_BUILD_DIR', 'dist'), 'manifest.json')
+        if os.path.exists(path):
+            with open(path) as handle:
+                manifest = json.load(handle)
+            self.files = manifest['files']
+            self.encodings = manifest['encodings']
+            self.srcsets = manifest['srcsets']
+            self.immutable = set(self.files.values())
+        app.url_defaults(self.fingerprint)
+        app.view_functions['static'] = self.serve
+        app.jinja_env.globals['asset_srcset'] = self.srcset
+
+    def fingerprint(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.files:
+            values['filename'] = self.files[values['filename']]
+
+    def srcset(self, filename):
+        # "url 480w, url 960w, ..." for a built image, '' otherwise
+        return ', '.join(f'{url_for("static", filename=variant)} {width}w'
+                         for width, variant in self.srcsets.get(filename, []))
+
+    def serve(self, filename):
+        if filename not in self.immutable:
+            return self.app.send_static_file(filename)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        for encoding in self.encodings.get(filename, ()):
+            if encoding in request.accept_encodings:
+                suffix = '.br' if encoding == 'br' else '.gz'
+                response = send_from_directory(self.app.static_folder, filename + suffix,
+                                               mimetype=mimetype, max_age=ONE_YEAR)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.app.static_folder, filename, mimetype=mimetype, max_age=ONE_YEAR)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add('Accept-Encoding')
+        return response
@@ -0,0 +1,89 @@
+"""Login latency under concurrent load for each password hashing policy.
+
+    python benchmarks/login_hashing.py --clients 16 --logins 20
+    python benchmarks/login_hashing.py --policy scrypt:16384:8:1 --policy pbkdf2:sha256:600000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+POLICIES = ['pbkdf2:sha256:260000', 'pbkdf2:sha256:600000', 'scrypt:16384:8:1', 'scrypt:32768:8:1']
+
+
+def run(args):
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    from app import app, db, User, password_policy
+
+    app_module.upgrade_db()
+    with app.app_context():
+        db.session.add(User(username='bencher', email='bench@example.com',
+                            password=password_policy.hash('bench-password')))
+        db.session.commit()
+
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def client():
+        test_client = app.test_client()
+        for _ in range(args.logins):
+            started = time.perf_counter()
+            response = test_client.post('/login', data={'username': 'bencher', 'password': 'bench-password'})
+            elapsed = time.perf_counter() - started
+            with lock:
+                if response.status_code == 302 and response.headers['Location'].startswith('/?'):
+                    latencies.append(elapsed)
+                else:
+                    failures.append(response.status_code)
+
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    print(json.dumps({
+        'logins_per_s': len(latencies) / wall,
+        'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else 0,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0,
+        'failures': len(failures),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--logins', type=int, default=20, help='logins per client')
+    parser.add_argument('--workers', type=int, default=4, help='PASSWORD_HASH_WORKERS')
+    parser.add_argument('--policy', action='append', help='hash method to measure (repeatable)')
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        return run(args)
+
+    print(f'{"policy":<24} {"logins/s":>10} {"p50 ms":>8} {"p99 ms":>8} {"failures":>9}')
+    for policy in args.policy or POLICIES:
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(tmp, "bench.db")}',
+                       PASSWORD_HASH_METHOD=policy, PASSWORD_HASH_WORKERS=str(args.workers),
+                       RATE_LIMIT_ENABLED='0')
+            command = [sys.executable, __file__, '--run', '--clients', str(args.clients), '--logins', str(args.logins)]
+            output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+        print(f'{policy:<24} {result["logins_per_s"]:>10.1f} {result["p50_ms"]:>8.1f} {result["p99_ms"]:>8.1f} '
+              f'{result["failures"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+"""Benchmark every route in app.py against a synthetic dataset.
+
+Seeds a temporary SQLite file, drives the Flask test client through each
+scenario and reports throughput, latency percentiles, queries per request
+and peak RSS. Results can be saved as JSON and compared across commits:
+
+    python benchmarks/routes.py --posts 20000 --output before.json
+    python benchmarks/routes.py --posts 20000 --compare before.json
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = 'bench-password'
+
+
+def seed(app_module, args):
+    from sqlalchemy import insert
+
+    db = app_module.db
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    # one real hash shared by every account keeps seeding fast
+    pwhash = app_module.password_policy.hash(PASSWORD)
+
+    def chunks(rows, size=5000):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def insert_all(table, rows):
+        for batch in chunks(rows):
+            db.session.execute(insert(table), batch)
+
+    insert_all(app_module.User.__table__, (
+        {'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com', 'password': pwhash, 'joined_at': now}
+        for i in range(1, args.users + 1)))
+    insert_all(app_module.Category.__table__, (
+        {'id': i, 'name': f'category{i}', 'created_at': now} for i in range(1, args.categories + 1)))
+    insert_all(app_module.Post.__table__, (
+        {'id': i, 'title': f'Post {i}', 'content': f'Body of post {i} ' * 20,
+         'author_id': rng.randint(1, args.users), 'created_at': now - timedelta(minutes=args.posts - i)}
+        for i in range(1, args.posts + 1)))
+    insert_all(app_module.Category.post_categories, (
+        {'post_id': i, 'category_id': rng.randint(1, args.categories)} for i in range(1, args.posts + 1)))
+    insert_all(app_module.Comment.__table__, (
+        {'content': f'Comment {i}', 'author_id': rng.randint(1, args.users),
+         'post_id': rng.randint(1, args.posts), 'created_at': now}
+        for i in range(args.comments)))
+    likes = {(rng.randint(1, args.users), rng.randint(1, args.posts)) for _ in range(args.likes)}
+    insert_all(app_module.Like.__table__, ({'user_id': user_id, 'post_id': post_id} for user_id, post_id in likes))
+    db.session.commit()
+    app_module.reconcile_counters()
+    app_module.reconcile_user_stats()
+
+
+def scenarios(args, rng, deep_cursor):
+    # name -> function(client) returning a response
+    def post_id():
+        return rng.randint(1, args.posts)
+
+    return {
+        'login': lambda c: c.post('/login', data={'username': f'user{rng.randint(1, args.users)}', 'password': PASSWORD}),
+        'posts': lambda c: c.get('/posts'),
+        'posts_deep': lambda c: c.get(f'/posts?before={deep_cursor}'),
+        'post_details': lambda c: c.get(f'/post.{post_id()}'),
+        'user': lambda c: c.get('/user'),
+        'like_post': lambda c: c.get(f'/like_post.{post_id()}/posts'),
+        'add_comment': lambda c: c.post(f'/post{post_id()}/add_comment', data={'content': 'benchmark comment'}),
+        'new_post': lambda c: c.post('/new-post', data={'title': 'Benchmark post', 'text': 'Benchmark body',
+                                                        'category': 'category1'}),
+    }
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(args):
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    from app import app
+
+    app_module.upgrade_db()
+    with app.app_context():
+        started = time.perf_counter()
+        seed(app_module, args)
+        seed_seconds = time.perf_counter() - started
+        # a page from the middle of the feed
+        middle = app_module.db.session.get(app_module.Post, args.posts // 2)
+        deep_cursor = app_module.encode_cursor(middle.created_at, middle.id)
+
+    results = {}
+    selected = args.route or list(scenarios(args, random.Random(), deep_cursor))
+    for name in selected:
+        samples, queries, errors = [], [], []
+        lock = threading.Lock()
+
+        def worker(index):
+            rng = random.Random(args.seed + index)
+            actions = scenarios(args, rng, deep_cursor)
+            client = app.test_client()
+            client.post('/login', data={'username': f'user{index % args.users + 1}', 'password': PASSWORD})
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                response = actions[name](client)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if response.status_code >= 400:
+                        errors.append(response.status_code)
+                    samples.append(elapsed)
+                    queries.append(int(response.headers.get('X-Query-Count', 0)))
+
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        samples.sort()
+        queries.sort()
+        results[name] = {
+            'requests': len(samples),
+            'errors': len(errors),
+            'throughput': len(samples) / wall,
+            'p50_ms': percentile(samples, 50) * 1000,
+            'p95_ms': percentile(samples, 95) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000,
+            'queries_p50': percentile(queries, 50),
+            'queries_max': queries[-1] if queries else 0,
+        }
+    app_module.like_buffer.flush()
+
+    print(json.dumps({
+        'dataset': {key: getattr(args, key) for key in ('users', 'posts', 'comments', 'likes', 'categories')},
+        'seed_seconds': seed_seconds,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'routes': results,
+    }))
+
+
+def report(result, baseline=None):
+    print(f'dataset: {result["dataset"]}  seeded in {result["seed_seconds"]:.1f}s  '
+          f'peak RSS {result["peak_rss_mb"]:.0f} MB')
+    print(f'{"route":<14} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"errors":>7}'
+          + ('  vs baseline p50' if baseline else ''))
+    for name, route in result['routes'].items():
+        line = (f'{name:<14} {route["throughput"]:>9.1f} {route["p50_ms"]:>8.2f} {route["p95_ms"]:>8.2f} '
+                f'{route["p99_ms"]:>8.2f} {route["queries_p50"]:>8} {route["errors"]:>7}')
+        before = baseline and baseline['routes'].get(name)
+        if before and before['p50_ms']:
+            line += f'  {(route["p50_ms"] / before["p50_ms"] - 1) * 100:+.1f}%'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=5000)
+    parser.add_argument('--comments', type=int, default=20000)
+    parser.add_argument('--likes', type=int, default=50000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=50, help='requests per client and route')
+    parser.add_argument('--concurrency', type=int, default=1, help='concurrent clients')
+    parser.add_argument('--route', action='append', help='only benchmark this route (repeatable)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the JSON result here')
+    parser.add_argument('--compare', help='JSON result of an earlier run to compare against')
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        return run(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # a fresh process per run, so peak RSS and caches start clean
+        # every simulated client shares one address, which the rate limits would throttle
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(tmp, "bench.db")}', SQL_PROFILING='1',
+                   RATE_LIMIT_ENABLED='0')
+        command = [sys.executable, __file__, '--run'] + [arg for arg in sys.argv[1:]]
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+    report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(result, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
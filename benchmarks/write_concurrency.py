@@ -0,0 +1,134 @@
+"""Concurrent like/comment write throughput against a local SQLite file,
+with the stock SQLite settings ("before") and the app's tuned profile ("after").
+
+    python benchmarks/write_concurrency.py --writers 8 --readers 4 --seconds 10
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = {
+    # sqlite3 module defaults: rollback journal, synchronous=FULL, 5s busy wait
+    'before': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_BUSY_TIMEOUT_MS': '5000'},
+    'after': {'SQLITE_JOURNAL_MODE': 'WAL', 'SQLITE_SYNCHRONOUS': 'NORMAL', 'SQLITE_BUSY_TIMEOUT_MS': '5000'},
+}
+
+
+def seed(app_module, users, posts):
+    db = app_module.db
+    now = app_module.datetime.utcnow()
+    db.session.execute(app_module.User.__table__.insert(), [
+        {'username': f'bench{i}', 'email': f'bench{i}@example.com', 'password': 'x', 'joined_at': now}
+        for i in range(users)])
+    db.session.execute(app_module.Post.__table__.insert(), [
+        {'title': f'post {i}', 'content': 'bench', 'author_id': i % users + 1, 'created_at': now}
+        for i in range(posts)])
+    db.session.commit()
+
+
+def run(args):
+    sys.path.insert(0, ROOT)
+    import app as app_module
+    from app import app, db, Comment, Like, Post, bump_counter, feed_page
+
+    app_module.upgrade_db()
+    with app.app_context():
+        seed(app_module, args.users, args.posts)
+
+    stop = threading.Event()
+    results = {'writes': 0, 'reads': 0, 'errors': 0, 'latencies': []}
+    lock = threading.Lock()
+
+    def writer():
+        with app.app_context():
+            while not stop.is_set():
+                user_id = random.randint(1, args.users)
+                post_id = random.randint(1, args.posts)
+                started = time.perf_counter()
+                try:
+                    if random.random() < 0.5:
+                        db.session.add(Like(user_id=user_id, post_id=post_id))
+                        bump_counter(post_id, Post.like_count, 1)
+                    else:
+                        db.session.add(Comment(content='bench', author_id=user_id, post_id=post_id))
+                        bump_counter(post_id, Post.comment_count, 1)
+                    db.session.commit()
+                    ok = True
+                except Exception as error:
+                    db.session.rollback()
+                    # duplicate likes are expected, lock errors are what we measure
+                    ok = 'UNIQUE' in str(error)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    if ok:
+                        results['writes'] += 1
+                        results['latencies'].append(elapsed)
+                    else:
+                        results['errors'] += 1
+
+    def reader():
+        with app.app_context():
+            while not stop.is_set():
+                try:
+                    feed_page(Post.query)
+                    db.session.rollback()
+                    with lock:
+                        results['reads'] += 1
+                except Exception:
+                    db.session.rollback()
+                    with lock:
+                        results['errors'] += 1
+
+    threads = [threading.Thread(target=writer) for _ in range(args.writers)]
+    threads += [threading.Thread(target=reader) for _ in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(results['latencies']) or [0]
+    print(json.dumps({
+        'writes_per_s': results['writes'] / args.seconds,
+        'reads_per_s': results['reads'] / args.seconds,
+        'errors': results['errors'],
+        'write_p50_ms': latencies[len(latencies) // 2] * 1000,
+        'write_p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--posts', type=int, default=1000)
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        return run(args)
+
+    print(f'{"profile":<8} {"writes/s":>10} {"reads/s":>10} {"errors":>8} {"p50 ms":>8} {"p99 ms":>8}')
+    for name, profile in PROFILES.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            # each profile gets a fresh process and database file
+            env = dict(os.environ, DATABASE_URL=f'sqlite:///{os.path.join(tmp, "bench.db")}', **profile)
+            output = subprocess.run([sys.executable, __file__, '--run'] + sys.argv[1:],
+                                    env=env, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+        print(f'{name:<8} {result["writes_per_s"]:>10.0f} {result["reads_per_s"]:>10.0f} {result["errors"]:>8} '
+              f'{result["write_p50_ms"]:>8.1f} {result["write_p99_ms"]:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,367 @@
+# Streaming NDJSON export/import of users, categories, posts, comments and likes.
+#
+# One JSON object per line, tagged with "type" and written in dependency
+# order, so an import resolves every reference in a single pass. Users and
+# categories are referred to by name and matched against the target
+# database through in-memory maps. Posts keep their ids where those are free
+# here and get new ones where they aren't; comments and likes follow their
+# post through an exported id -> new id map, and comments always get new ids.
+# That map is a table in the target database, written in the same transaction
+# as each chunk, so memory doesn't grow with the file and a resumed import
+# still has it. Both directions work in fixed-size chunks, and an import
+# records a checkpoint (byte offset and counts) after every committed chunk.
+import itertools
+import json
+import os
+from datetime import datetime
+from operator import itemgetter
+
+from sqlalchemy import Column, Integer, MetaData, Table, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib json module is used without it
+    orjson = None
+
+ORDER = ['user', 'category', 'post', 'comment', 'like']
+
+# exported post id -> id in this database; dropped once an import completes
+post_id_map = Table('import_post_ids', MetaData(),
+                    Column('old_id', Integer, primary_key=True),
+                    Column('new_id', Integer, nullable=False))
+
+
+def _time(value):
+    return value.isoformat() if value else None
+
+
+def _chunks(connection, table, chunk_size):
+    # keyset scan over the primary key; never holds more than one chunk
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            select(table).where(table.c.id > last_id).order_by(table.c.id).limit(chunk_size)).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+
+def export_records(connection, tables, chunk_size=10000):
+    usernames = dict(connection.execute(select(tables['user'].c.id, tables['user'].c.username)).all())
+    category_names = dict(connection.execute(select(tables['category'].c.id, tables['category'].c.name)).all())
+
+    for rows in _chunks(connection, tables['user'], chunk_size):
+        for row in rows:
+            yield {'type': 'user', 'username': row.username, 'email': row.email,
+                   'password': row.password, 'joined_at': _time(row.joined_at)}
+    for rows in _chunks(connection, tables['category'], chunk_size):
+        for row in rows:
+            yield {'type': 'category', 'name': row.name, 'created_at': _time(row.created_at)}
+
+    links = tables['post_categories']
+    for rows in _chunks(connection, tables['post'], chunk_size):
+        categories = {}
+        ids = [row.id for row in rows]
+        for post_id, category_id in connection.execute(
+                select(links.c.post_id, links.c.category_id).where(links.c.post_id.in_(ids))):
+            categories.setdefault(post_id, []).append(category_names[category_id])
+        for row in rows:
+            yield {'type': 'post', 'id': row.id, 'title': row.title, 'content': row.content,
+                   'author': usernames.get(row.author_id), 'categories': categories.get(row.id, []),
+                   'created_at': _time(row.created_at)}
+    for rows in _chunks(connection, tables['comment'], chunk_size):
+        for row in rows:
+            yield {'type': 'comment', 'id': row.id, 'post_id': row.post_id, 'author': usernames.get(row.author_id),
+                   'content': row.content, 'created_at': _time(row.created_at)}
+    for rows in _chunks(connection, tables['like'], chunk_size):
+        for row in rows:
+            if row.post_id is not None and row.user_id in usernames:
+                yield {'type': 'like', 'post_id': row.post_id, 'user': usernames[row.user_id]}
+
+
+def export_ndjson(connection, tables, handle, chunk_size=10000):
+    count = 0
+    for record in export_records(connection, tables, chunk_size):
+        handle.write(json.dumps(record, separators=(',', ':'), ensure_ascii=False))
+        handle.write('\n')
+        count += 1
+    return count
+
+
+class Importer:
+    def __init__(self, connection, tables, chunk_size=10000, resuming=False):
+        self.connection = connection
+        self.tables = tables
+        self.chunk_size = chunk_size
+        self.insert = postgresql.insert if connection.dialect.name == 'postgresql' else sqlite.insert
+        user, category = tables['user'], tables['category']
+        self.user_ids = dict(connection.execute(select(user.c.username, user.c.id)).all())
+        self.category_ids = dict(connection.execute(select(category.c.name, category.c.id)).all())
+        if not resuming:
+            post_id_map.drop(connection, checkfirst=True)
+        post_id_map.create(connection, checkfirst=True)
+        # looking for rows from an earlier run is only needed if there can be any
+        self.dedupe = resuming or connection.scalar(select(tables['post'].c.id).limit(1)) is not None
+        # the most recently used part of the post id map, so most lookups skip the table
+        self.post_ids = {}
+        self.cache_size = chunk_size * 20
+        self.pending = {name: [] for name in ('post', 'post_categories', 'comment', 'like')}
+        # rows actually inserted; records matching rows already there count as existing
+        self.counts = dict.fromkeys(ORDER, 0)
+        self.existing = 0
+        self.buffered = 0
+        self.skipped = 0
+
+    def add(self, record):
+        kind = record.get('type')
+        if kind == 'user':
+            self._add_named('user', 'username', self.user_ids, {
+                'username': record['username'], 'email': record['email'], 'password': record['password'],
+                'joined_at': _parse_time(record.get('joined_at'))})
+            return
+        if kind == 'category':
+            self._add_named('category', 'name', self.category_ids, {
+                'name': record['name'], 'created_at': _parse_time(record.get('created_at'))})
+            return
+        if kind == 'post':
+            author_id = self.user_ids.get(record.get('author'))
+            if author_id is None:
+                self.skipped += 1
+                return
+            self.pending['post'].append({
+                'id': record['id'], 'title': record['title'], 'content': record['content'],
+                'author_id': author_id, 'created_at': _parse_time(record.get('created_at'))})
+            for name in record.get('categories', []):
+                if name in self.category_ids:
+                    self.pending['post_categories'].append(
+                        {'post_id': record['id'], 'category_id': self.category_ids[name]})
+        elif kind == 'comment':
+            author_id = self.user_ids.get(record.get('author'))
+            if author_id is None:
+                self.skipped += 1
+                return
+            # comments get new ids; nothing refers to them
+            self.pending['comment'].append({
+                'post_id': record['post_id'], 'author_id': author_id,
+                'content': record['content'], 'created_at': _parse_time(record.get('created_at'))})
+        elif kind == 'like':
+            user_id = self.user_ids.get(record.get('user'))
+            if user_id is None:
+                self.skipped += 1
+                return
+            self.pending['like'].append({'user_id': user_id, 'post_id': record['post_id']})
+        else:
+            self.skipped += 1
+            return
+        self.buffered += 1
+
+    def _add_named(self, table_name, column, ids, row):
+        # users and categories are few and referenced by name, so they go in
+        # one at a time and land in the lookup map immediately
+        name = row[column]
+        if name in ids:
+            self.existing += 1
+            return
+        table = self.tables[table_name]
+        result = self.connection.execute(
+            self.insert(table).values(row).on_conflict_do_nothing().returning(table.c.id)).first()
+        if result is None:
+            result = self.connection.execute(select(table.c.id).where(table.c[column] == name)).first()
+            self.existing += 1
+        else:
+            self.counts[table_name] += 1
+        ids[name] = result[0]
+
+    def full(self):
+        return self.buffered >= self.chunk_size
+
+    def _insert_posts(self):
+        # a post already here (same author, title and time, e.g. from an earlier
+        # run) is reused; otherwise the exported id is kept when it's free and a
+        # new one is taken when another post has it
+        post = self.tables['post']
+        rows = self.pending['post']
+        key = lambda row: (row['author_id'], row['title'], row['created_at'])
+        found = {}
+        if self.dedupe:
+            found = {(author_id, title, created_at): post_id
+                     for post_id, author_id, title, created_at in self.connection.execute(
+                         select(post.c.id, post.c.author_id, post.c.title, post.c.created_at)
+                         .where(post.c.created_at.in_({row['created_at'] for row in rows})))}
+        mapped = {}
+        fresh = []
+        for row in rows:
+            if key(row) in found:
+                mapped[row['id']] = found[key(row)]
+                self.existing += 1
+            else:
+                fresh.append(row)
+        if fresh:
+            self._insert_new_posts(fresh, mapped)
+        self.connection.execute(self.insert(post_id_map).on_conflict_do_nothing(),
+                                [{'old_id': old_id, 'new_id': new_id} for old_id, new_id in mapped.items()])
+        self._remember(mapped)
+        return mapped
+
+    def _insert_new_posts(self, fresh, mapped):
+        post = self.tables['post']
+        kept = set(self.connection.scalars(
+            self.insert(post).on_conflict_do_nothing().returning(post.c.id), fresh))
+        if self.connection.dialect.name == 'postgresql':
+            # explicit ids don't move the sequence, so move it past them before taking new ones
+            _sync_sequence(self.connection, post)
+        for row in fresh:
+            if row['id'] in kept:
+                mapped[row['id']] = row['id']
+            else:
+                values = {name: value for name, value in row.items() if name != 'id'}
+                mapped[row['id']] = self.connection.scalar(
+                    self.insert(post).values(values).returning(post.c.id))
+        self.counts['post'] += len(fresh)
+
+    def _remember(self, mapped):
+        self.post_ids.update(mapped)
+        # oldest entries first out
+        for old_id in list(itertools.islice(self.post_ids, max(len(self.post_ids) - self.cache_size, 0))):
+            del self.post_ids[old_id]
+
+    def _resolve(self, name):
+        # exported post ids -> ids here; rows whose post wasn't imported are dropped,
+        # since a post with that id in this database isn't the same post
+        needed = {row['post_id'] for row in self.pending[name]}
+        post_ids = {old_id: self.post_ids[old_id] for old_id in needed if old_id in self.post_ids}
+        wanted = needed.difference(post_ids)
+        if wanted:
+            found = dict(self.connection.execute(
+                select(post_id_map.c.old_id, post_id_map.c.new_id).where(post_id_map.c.old_id.in_(wanted))).all())
+            post_ids.update(found)
+            self._remember(found)
+        rows = []
+        for row in self.pending[name]:
+            post_id = post_ids.get(row['post_id'])
+            if post_id is None:
+                self.skipped += 1
+            else:
+                row['post_id'] = post_id
+                rows.append(row)
+        return rows
+
+    def _insert_comments(self):
+        comment = self.tables['comment']
+        rows = self._resolve('comment')
+        if not rows:
+            return
+        fresh = self._new_comments(rows) if self.dedupe else rows
+        self.existing += len(rows) - len(fresh)
+        if fresh:
+            # in post order, so the post_id index is written in runs; the sort is
+            # stable, so a post's comments keep their order
+            fresh.sort(key=itemgetter('post_id'))
+            self.connection.execute(self.insert(comment), fresh)
+            self.counts['comment'] += len(fresh)
+
+    def _new_comments(self, rows):
+        # comments already on these posts with the same author, time and text are
+        # from an earlier run; candidates come from the post_id index, and only
+        # their text is read
+        comment = self.tables['comment']
+        key = lambda row: (row['post_id'], row['author_id'], row['created_at'])
+        wanted = {key(row) for row in rows}
+        candidates = [comment_id for comment_id, *found in self.connection.execute(
+            select(comment.c.id, comment.c.post_id, comment.c.author_id, comment.c.created_at)
+            .where(comment.c.post_id.in_({row['post_id'] for row in rows}))) if tuple(found) in wanted]
+        if not candidates:
+            return rows
+        found = set()
+        for start in range(0, len(candidates), self.chunk_size):
+            found.update(self.connection.execute(
+                select(comment.c.post_id, comment.c.author_id, comment.c.created_at, comment.c.content)
+                .where(comment.c.id.in_(candidates[start:start + self.chunk_size]))).tuples())
+        return [row for row in rows if key(row) + (row['content'],) not in found]
+
+    def _insert_likes(self):
+        like = self.tables['like']
+        rows = self._resolve('like')
+        if rows:
+            # in unique_like order; one like per user and post, so an existing one is
+            # a conflict, and the driver's total rowcount says how many went in where it's reliable
+            rows.sort(key=itemgetter('user_id', 'post_id'))
+            statement = self.insert(like).on_conflict_do_nothing()
+            if self.connection.dialect.supports_sane_multi_rowcount:
+                inserted = self.connection.execute(statement, rows).rowcount
+            else:
+                inserted = len(self.connection.scalars(statement.returning(like.c.id), rows).all())
+            self.counts['like'] += inserted
+            self.existing += len(rows) - inserted
+
+    def flush(self):
+        # parents before children, so foreign keys hold within a chunk
+        if self.pending['post']:
+            mapped = self._insert_posts()
+            links = [dict(row, post_id=mapped[row['post_id']]) for row in self.pending['post_categories']]
+            if links:
+                self.connection.execute(self.insert(self.tables['post_categories']).on_conflict_do_nothing(), links)
+        self._insert_comments()
+        self._insert_likes()
+        for rows in self.pending.values():
+            rows.clear()
+        self.buffered = 0
+
+
+def _loads(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line.decode('utf-8'))
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else datetime.utcnow()
+
+
+def _sync_sequence(connection, table):
+    connection.execute(select(func.setval(
+        func.pg_get_serial_sequence(table.name, 'id'), func.coalesce(func.max(table.c.id), 1))))
+
+
+def import_ndjson(engine, tables, path, checkpoint_path=None, chunk_size=10000, progress=None):
+    # returns (inserted rows per type, records already present, skipped records);
+    # resumes from checkpoint_path if it exists
+    offset, counts = 0, None
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as handle:
+            checkpoint = json.load(handle)
+        offset, counts = checkpoint['offset'], checkpoint['counts']
+
+    with open(path, 'rb') as handle, engine.connect() as connection:
+        handle.seek(offset)
+        if connection.dialect.name == 'sqlite':
+            # a 32 MB page cache for this connection, so index writes stay in memory between commits
+            connection.exec_driver_sql('PRAGMA cache_size=-32768')
+        importer = Importer(connection, tables, chunk_size, resuming=counts is not None)
+        if counts:
+            importer.counts.update(counts)
+
+        def commit():
+            importer.flush()
+            connection.commit()
+            if checkpoint_path:
+                # written aside and renamed, so a crash never leaves half a checkpoint
+                with open(checkpoint_path + '.tmp', 'w') as checkpoint:
+                    json.dump({'offset': offset, 'counts': importer.counts}, checkpoint)
+                os.replace(checkpoint_path + '.tmp', checkpoint_path)
+            if progress:
+                progress(offset, importer.counts)
+
+        for line in handle:
+            offset += len(line)
+            if line.strip():
+                importer.add(_loads(line))
+            if importer.full():
+                commit()
+        commit()
+        post_id_map.drop(connection)
+        connection.commit()
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return importer.counts, importer.existing, importer.skipped
@@ -0,0 +1,95 @@
+# In-memory catalog of categories and their post counts
+#
+# Loaded with one grouped query, then kept current by applying count changes
+# as posts are tagged and deleted, so category pickers and the tag cloud need
+# no query per request. A periodic reload picks up writes made by other
+# worker processes.
+import math
+import threading
+import time
+from collections import namedtuple
+
+CategoryEntry = namedtuple('CategoryEntry', 'id name post_count')
+
+
+class CategoryCatalog:
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self.load = None
+        self.by_id = {}
+        self.by_name = {}
+        self.expires = 0.0
+        self.lock = threading.Lock()
+        self.reloads = 0
+        self.adjustments = 0
+
+    def init_app(self, app, load):
+        # load() returns (id, name, post_count) rows for every category
+        self.ttl = app.config.get('CATEGORY_CATALOG_TTL', self.ttl)
+        self.load = load
+
+    def _current(self):
+        # call with the lock held
+        if time.monotonic() >= self.expires:
+            self.by_id = {row[0]: CategoryEntry(*row) for row in self.load()}
+            self.by_name = {entry.name: entry for entry in self.by_id.values()}
+            self.expires = time.monotonic() + self.ttl
+            self.reloads += 1
+        return self.by_id
+
+    def _store(self, entry):
+        self.by_id[entry.id] = entry
+        self.by_name[entry.name] = entry
+
+    def all(self):
+        with self.lock:
+            return sorted(self._current().values(), key=lambda entry: entry.name.lower())
+
+    def get(self, name):
+        with self.lock:
+            self._current()
+            return self.by_name.get(name)
+
+    def by_ids(self):
+        # {id: entry} as of now; a snapshot, not updated afterwards
+        with self.lock:
+            return dict(self._current())
+
+    def add(self, category_id, name):
+        with self.lock:
+            if category_id not in self._current():
+                self._store(CategoryEntry(category_id, name, 0))
+
+    def adjust(self, deltas):
+        # deltas: {category_id: change in post count}
+        with self.lock:
+            entries = self._current()
+            for category_id, delta in deltas.items():
+                entry = entries.get(category_id)
+                if entry is None:
+                    # created elsewhere; the next reload brings it in
+                    self.expires = 0.0
+                    continue
+                self._store(entry._replace(post_count=max(0, entry.post_count + delta)))
+            self.adjustments += 1
+
+    def invalidate(self):
+        with self.lock:
+            self.expires = 0.0
+
+    def cloud(self, steps=5):
+        # (entry, weight 1..steps) for categories with posts, weights on a log scale
+        entries = [entry for entry in self.all() if entry.post_count]
+        if not entries:
+            return []
+        top = math.log1p(max(entry.post_count for entry in entries))
+        return [(entry, 1 + round((steps - 1) * math.log1p(entry.post_count) / top)) for entry in entries]
+
+    def stats(self):
+        return {
+            'categories': len(self.by_id),
+            'posts_tagged': sum(entry.post_count for entry in self.by_id.values()),
+            'reloads': self.reloads,
+            'adjustments': self.adjustments,
+            'ttl': self.ttl,
+        }
@@ -0,0 +1,79 @@
+# LRU cache for rendered HTML fragments with a memory cap
+import sys
+import threading
+from collections import OrderedDict, defaultdict
+
+from markupsafe import Markup
+
+
+class FragmentCache:
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        # owner id -> keys, so one post's fragments can be dropped without a scan
+        self.keys_by_owner = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get('FRAGMENT_CACHE_MAX_BYTES', self.max_bytes)
+
+    def get_or_render(self, owner, key, render):
+        # key must change whenever the rendered output would
+        key = (owner, key)
+        with self.lock:
+            fragment = self.entries.get(key)
+            if fragment is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return fragment
+            self.misses += 1
+        fragment = Markup(render())
+        self._store(owner, key, fragment)
+        return fragment
+
+    def _store(self, owner, key, fragment):
+        size = sys.getsizeof(fragment)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = fragment
+            self.keys_by_owner[owner].add(key)
+            self.size += size
+            while self.size > self.max_bytes:
+                old_key, old_fragment = self.entries.popitem(last=False)
+                self.size -= sys.getsizeof(old_fragment)
+                self._forget(old_key)
+
+    def _forget(self, key):
+        keys = self.keys_by_owner.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_owner[key[0]]
+
+    def invalidate(self, owner):
+        with self.lock:
+            for key in self.keys_by_owner.pop(owner, ()):
+                self.size -= sys.getsizeof(self.entries.pop(key))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_owner.clear()
+            self.size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,60 @@
+# gunicorn settings; every one can be tuned from the environment
+#
+# The app is imported once in the master and the workers are forked from it
+# (preload), so they start warm and share the imported code and loaded caches
+# copy-on-write. Each worker then drops the database connections it inherited
+# and starts its own background threads on first use.
+#
+# Live updates use Flask-SocketIO in threading mode. With several workers, the
+# load balancer must keep each client on one worker (sticky sessions) and
+# SOCKETIO_MESSAGE_QUEUE must be set so broadcasts reach every worker.
+import gc
+import os
+import sys
+import time
+
+import serving
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+# recycle workers after this many requests to cap memory growth; 0 never does
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10))
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+
+
+def when_ready(server):
+    app = sys.modules.get('app')
+    if app is not None and app.startup_seconds is not None:
+        server.log.info('app loaded in %.2fs, master RSS %.1f MB',
+                        app.startup_seconds, serving.rss_bytes() / 2 ** 20)
+
+
+def pre_fork(server, worker):
+    # objects created so far live for the whole process; keeping them out of
+    # the collector stops it from touching (and so copying) their pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    worker.forked_at = time.perf_counter()
+    app = sys.modules.get('app')
+    if app is not None:
+        # connections opened by the master must not be shared with workers
+        with app.app.app_context():
+            app.db.engine.dispose(close=False)
+
+
+def post_worker_init(worker):
+    app = sys.modules.get('app')
+    if app is not None:
+        # picks up account deletions left unfinished by workers that exited
+        app.account_deletions.start()
+    worker.log.info('worker %s ready in %.2fs, RSS %.1f MB', worker.pid,
+                    time.perf_counter() - worker.forked_at, serving.rss_bytes() / 2 ** 20)
@@ -0,0 +1,56 @@
+# Bounded LRU + TTL cache of logged-in users, so user_loader needs no query when warm.
+# It is per process: invalidate() only reaches this process's entries, so the
+# TTL is what bounds staleness across workers.
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdentityCache:
+    def __init__(self, max_entries=10000, ttl=10):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # user_id -> (credential stamp, expires_at, user)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('IDENTITY_CACHE_SIZE', self.max_entries)
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', self.ttl)
+
+    def get(self, user_id, stamp):
+        # a session carrying an outdated stamp never matches
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[0] != stamp or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self.entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, user_id, stamp, user):
+        with self.lock:
+            self.entries[user_id] = (stamp, time.monotonic() + self.ttl, user)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            if self.entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,130 @@
+# Write-behind buffer for likes: requests only queue (user_id, post_id) and
+# a background thread writes them in batches
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger('likes')
+
+
+class LikeBuffer:
+    def __init__(self, flush_interval=0.5, flush_size=500, max_attempts=5):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        # a batch is given back to the queue after a failed write, and dropped
+        # only after this many failures in a row
+        self.max_attempts = max_attempts
+        self.attempts = 0
+        self.write = None
+        # insertion-ordered set of pending (user_id, post_id)
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.closed = False
+        self.queued = 0
+        self.deduplicated = 0
+        self.flushes = 0
+        self.written = 0
+        self.retries = 0
+        self.failed = 0
+        self.flush_ms = deque(maxlen=1000)
+
+    def init_app(self, app, write):
+        # write(pairs) stores one batch and returns how many likes were new
+        self.write = write
+        self.flush_interval = app.config.get('LIKE_FLUSH_INTERVAL', self.flush_interval)
+        self.flush_size = app.config.get('LIKE_FLUSH_SIZE', self.flush_size)
+        self.max_attempts = app.config.get('LIKE_FLUSH_ATTEMPTS', self.max_attempts)
+        atexit.register(self.close)
+
+    def add(self, user_id, post_id):
+        key = (user_id, post_id)
+        with self.lock:
+            if key in self.pending:
+                self.deduplicated += 1
+                return False
+            self.pending[key] = None
+            self.queued += 1
+            depth = len(self.pending)
+        self._ensure_thread()
+        if depth >= self.flush_size:
+            self.wakeup.set()
+        return True
+
+    def _ensure_thread(self):
+        # started on first use, and again in a forked worker where the thread didn't survive
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._run, name='like-flusher', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                batch, self.pending = list(self.pending), {}
+            if not batch:
+                return 0
+            started = time.perf_counter()
+            try:
+                written = self.write(batch)
+            except Exception:
+                self.attempts += 1
+                if self.attempts >= self.max_attempts:
+                    logger.exception('dropped %d likes after %d failed flushes', len(batch), self.attempts)
+                    self.failed += len(batch)
+                    self.attempts = 0
+                    return 0
+                logger.exception('flushing %d likes failed, will retry', len(batch))
+                self.retries += 1
+                with self.lock:
+                    # ahead of whatever was queued meanwhile, which keeps the order
+                    requeued = dict.fromkeys(batch)
+                    requeued.update(self.pending)
+                    self.pending = requeued
+                return 0
+            self.attempts = 0
+            self.flush_ms.append((time.perf_counter() - started) * 1000)
+            self.flushes += 1
+            self.written += written
+            return written
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        if self.thread is not None and self.pid == os.getpid():
+            self.thread.join(timeout=5)
+        self.flush()
+        if self.pending:
+            # the last chance before the process exits
+            logger.error('dropped %d likes at shutdown', len(self.pending))
+            self.failed += len(self.pending)
+            self.pending = {}
+
+    def stats(self):
+        latencies = sorted(self.flush_ms)
+        return {
+            'queue_depth': len(self.pending),
+            'queued': self.queued,
+            'deduplicated': self.deduplicated,
+            'flushes': self.flushes,
+            'written': self.written,
+            'retries': self.retries,
+            'failed': self.failed,
+            'flush_ms_p50': latencies[len(latencies) // 2] if latencies else 0,
+            'flush_ms_max': latencies[-1] if latencies else 0,
+        }
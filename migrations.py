@@ -0,0 +1,260 @@
+# Schema migrations, applied in order by `flask upgrade-db`
+#
+# A new database is created straight from the models. Every migration the
+# database hasn't seen yet is then applied, each in its own transaction and
+# keeping the data already there. Migrations are
+# written in plain SQL so they don't change meaning when the models do, and
+# must be idempotent since a new database already has the model tables.
+import re
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+import search
+
+MIGRATIONS = []
+
+
+def migration(version, name, foreign_keys=True):
+    # foreign_keys=False runs it with SQLite's enforcement off, as table rebuilds need
+    def register(function):
+        function.foreign_keys = foreign_keys
+        MIGRATIONS.append((version, name, function))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return function
+    return register
+
+
+def has_column(connection, table, column):
+    return column in {info['name'] for info in inspect(connection).get_columns(table)}
+
+
+@migration(1, 'post counters')
+def add_post_counters(connection):
+    if has_column(connection, 'post', 'like_count'):
+        return
+    connection.execute(text('ALTER TABLE post ADD COLUMN like_count INTEGER NOT NULL DEFAULT 0'))
+    connection.execute(text('ALTER TABLE post ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0'))
+    connection.execute(text(
+        'UPDATE post SET '
+        'like_count = (SELECT count(*) FROM "like" WHERE "like".post_id = post.id), '
+        'comment_count = (SELECT count(*) FROM comment WHERE comment.post_id = post.id)'))
+
+
+@migration(2, 'post version')
+def add_post_version(connection):
+    if not has_column(connection, 'post', 'version'):
+        connection.execute(text('ALTER TABLE post ADD COLUMN version INTEGER NOT NULL DEFAULT 1'))
+
+
+@migration(3, 'hot path indexes')
+def add_hot_path_indexes(connection):
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS ix_post_created_at_id ON post (created_at, id)',
+        'CREATE INDEX IF NOT EXISTS ix_post_author_id ON post (author_id)',
+        'CREATE INDEX IF NOT EXISTS ix_comment_post_id ON comment (post_id)',
+        'CREATE INDEX IF NOT EXISTS ix_comment_author_id ON comment (author_id)',
+        'CREATE INDEX IF NOT EXISTS ix_like_post_id ON "like" (post_id)',
+        'CREATE INDEX IF NOT EXISTS ix_post_categories_category_id ON post_categories (category_id)',
+    ):
+        connection.execute(text(statement))
+
+
+@migration(4, 'search index')
+def add_search_index(connection):
+    # FTS5 over post titles/bodies and comment bodies, kept current by triggers
+    if connection.dialect.name != 'sqlite':
+        return
+    if inspect(connection).has_table('search_index'):
+        return
+    for statement in (
+        "CREATE VIRTUAL TABLE search_index USING fts5("
+        "title, body, post_id UNINDEXED, tokenize='porter unicode61')",
+        # rank by bm25 with title matches weighted over body matches
+        "INSERT INTO search_index (search_index, rank) VALUES ('rank', 'bm25(5.0, 1.0)')",
+    ):
+        connection.execute(text(statement))
+    search.create_triggers(connection)
+    search.rebuild_index(connection)
+
+
+@migration(5, 'longer password hashes')
+def widen_password(connection):
+    # scrypt hashes are 162 characters; SQLite doesn't enforce VARCHAR lengths
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text('ALTER TABLE "user" ALTER COLUMN password TYPE VARCHAR(255)'))
+    elif connection.dialect.name == 'mysql':
+        connection.execute(text('ALTER TABLE user MODIFY password VARCHAR(255) NOT NULL'))
+
+
+@migration(6, 'category feed index')
+def add_category_feed_index(connection):
+    # covers category -> post id lookups; the old single-column index is a prefix of it
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_post_categories_category_id_post_id '
+                            'ON post_categories (category_id, post_id)'))
+    connection.execute(text('DROP INDEX IF EXISTS ix_post_categories_category_id'))
+
+
+CASCADING = {'post': ['user'], 'like': ['user', 'post'], 'comment': ['user', 'post'],
+             'post_categories': ['post', 'category']}
+REFERENCE = re.compile(r'(FOREIGN KEY\s*\([^)]*\)\s*REFERENCES\s*"?\w+"?\s*\([^)]*\))(?!\s*ON DELETE)', re.I)
+
+
+def rebuild_sqlite_table(connection, table, rewrite):
+    # SQLite can't alter a constraint: create the table anew, copy the rows
+    # across, swap it in and restore the indexes and triggers of the old one
+    rows = connection.execute(text('SELECT type, sql FROM sqlite_master WHERE tbl_name = :t AND sql IS NOT NULL'),
+                              {'t': table}).all()
+    create = next(sql for kind, sql in rows if kind == 'table')
+    if rewrite(create) == create:
+        return
+    connection.execute(text(f'DROP TABLE IF EXISTS "{table}_rebuilt"'))
+    connection.execute(text(re.sub(r'^CREATE TABLE\s+"?\w+"?', f'CREATE TABLE "{table}_rebuilt"', rewrite(create))))
+    connection.execute(text(f'INSERT INTO "{table}_rebuilt" SELECT * FROM "{table}"'))
+    connection.execute(text(f'DROP TABLE "{table}"'))
+    connection.execute(text(f'ALTER TABLE "{table}_rebuilt" RENAME TO "{table}"'))
+    for kind, sql in rows:
+        if kind != 'table':
+            connection.execute(text(sql))
+
+
+@migration(7, 'cascading deletes', foreign_keys=False)
+def add_cascading_deletes(connection):
+    # Deleting a user or post removes everything hanging off it in the
+    # database. Rows already pointing at missing parents could never be shown,
+    # and would fail the constraints once enforced, so they go first.
+    for statement in (
+        'DELETE FROM post WHERE author_id NOT IN (SELECT id FROM "user")',
+        'DELETE FROM "like" WHERE user_id IS NULL OR post_id IS NULL '
+        'OR user_id NOT IN (SELECT id FROM "user") OR post_id NOT IN (SELECT id FROM post)',
+        'DELETE FROM comment WHERE author_id NOT IN (SELECT id FROM "user") OR post_id NOT IN (SELECT id FROM post)',
+        'DELETE FROM post_categories '
+        'WHERE post_id NOT IN (SELECT id FROM post) OR category_id NOT IN (SELECT id FROM category)',
+    ):
+        connection.execute(text(statement))
+
+    if connection.dialect.name == 'sqlite':
+        for table in CASCADING:
+            rebuild_sqlite_table(connection, table, lambda sql: REFERENCE.sub(r'\1 ON DELETE CASCADE', sql))
+        return
+    drop = 'DROP FOREIGN KEY' if connection.dialect.name == 'mysql' else 'DROP CONSTRAINT'
+    preparer = connection.dialect.identifier_preparer
+    for table in CASCADING:
+        for key in inspect(connection).get_foreign_keys(table):
+            if (key['options'].get('ondelete') or '').upper() == 'CASCADE':
+                continue
+            columns = ', '.join(preparer.quote(column) for column in key['constrained_columns'])
+            referred = ', '.join(preparer.quote(column) for column in key['referred_columns'])
+            connection.execute(text(f'ALTER TABLE {preparer.quote(table)} {drop} {preparer.quote(key["name"])}'))
+            connection.execute(text(
+                f'ALTER TABLE {preparer.quote(table)} ADD CONSTRAINT {preparer.quote(key["name"])} '
+                f'FOREIGN KEY ({columns}) REFERENCES {preparer.quote(key["referred_table"])} ({referred}) '
+                f'ON DELETE CASCADE'))
+
+
+@migration(8, 'trending scores')
+def add_trending_scores(connection):
+    # log2 of each post's time-decayed activity (see trending.py)
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS trending_score ('
+        'post_id INTEGER NOT NULL PRIMARY KEY REFERENCES post (id) ON DELETE CASCADE, '
+        'score FLOAT NOT NULL)'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_trending_score_score ON trending_score (score)'))
+
+
+@migration(9, 'user stats')
+def add_user_stats(connection):
+    # per-user counters for profile pages, filled from the rows already there
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS user_stats ('
+        'user_id INTEGER NOT NULL PRIMARY KEY REFERENCES "user" (id) ON DELETE CASCADE, '
+        'post_count INTEGER NOT NULL DEFAULT 0, likes_received INTEGER NOT NULL DEFAULT 0, '
+        'comment_count INTEGER NOT NULL DEFAULT 0, likes_given INTEGER NOT NULL DEFAULT 0)'))
+    connection.execute(text(
+        'INSERT INTO user_stats (user_id, post_count, likes_received, comment_count, likes_given) '
+        'SELECT u.id, coalesce(p.n, 0), coalesce(p.likes, 0), coalesce(c.n, 0), coalesce(l.n, 0) '
+        'FROM "user" u '
+        'LEFT JOIN (SELECT author_id, count(*) AS n, sum(like_count) AS likes FROM post GROUP BY author_id) p '
+        'ON p.author_id = u.id '
+        'LEFT JOIN (SELECT author_id, count(*) AS n FROM comment GROUP BY author_id) c ON c.author_id = u.id '
+        'LEFT JOIN (SELECT user_id, count(*) AS n FROM "like" GROUP BY user_id) l ON l.user_id = u.id '
+        'WHERE u.id NOT IN (SELECT user_id FROM user_stats)'))
+    # profile pages page through one author's posts newest first; the old index is a prefix of this one
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_post_author_id_created_at_id '
+                            'ON post (author_id, created_at, id)'))
+    connection.execute(text('DROP INDEX IF EXISTS ix_post_author_id'))
+
+
+@migration(10, 'account deletion jobs')
+def add_account_deletion(connection):
+    # background deletions, kept here so any worker can report and finish them
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS account_deletion ('
+        'id VARCHAR(32) NOT NULL PRIMARY KEY, user_id INTEGER NOT NULL, '
+        "state VARCHAR(16) NOT NULL DEFAULT 'queued', total INTEGER NOT NULL, deleted INTEGER NOT NULL DEFAULT 0, "
+        'runner VARCHAR(120), touched_at DATETIME, created_at DATETIME NOT NULL, '
+        'started_at DATETIME, finished_at DATETIME)'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_account_deletion_state ON account_deletion (state)'))
+    # accounts locked by a deletion that lived only in a worker's memory get a job to finish them
+    connection.execute(text(
+        'INSERT INTO account_deletion (id, user_id, state, total, deleted, created_at) '
+        "SELECT 'user-' || u.id, u.id, 'queued', "
+        '(SELECT count(*) FROM post WHERE author_id = u.id) + (SELECT count(*) FROM comment WHERE author_id = u.id) '
+        '+ (SELECT count(*) FROM "like" WHERE user_id = u.id), 0, :now '
+        'FROM "user" u WHERE u.password = :locked '
+        'AND u.id NOT IN (SELECT user_id FROM account_deletion)'), {'now': datetime.utcnow(), 'locked': '!deleted'})
+
+
+def ensure_version_table(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations '
+        '(version INTEGER PRIMARY KEY, name VARCHAR(120) NOT NULL, applied_at DATETIME NOT NULL)'))
+
+
+def applied_versions(connection):
+    return {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def record(connection, version, name):
+    connection.execute(text('INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)'),
+                       {'v': version, 'n': name, 't': datetime.utcnow()})
+
+
+def pending(engine):
+    with engine.begin() as connection:
+        ensure_version_table(connection)
+        done = applied_versions(connection)
+    return [(version, name) for version, name, _ in MIGRATIONS if version not in done]
+
+
+def upgrade(engine, metadata):
+    # returns the names of the migrations that were applied
+    with engine.begin() as connection:
+        ensure_version_table(connection)
+        created = not inspect(connection).has_table('post')
+        if created:
+            metadata.create_all(connection)
+
+    applied = ['create schema'] if created else []
+    for version, name, function in MIGRATIONS:
+        with engine.connect() as connection:
+            if version in applied_versions(connection):
+                continue
+            connection.rollback()
+            suspend = connection.dialect.name == 'sqlite' and not function.foreign_keys
+            if suspend:
+                # the pragma is a no-op inside a transaction
+                connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+                connection.commit()
+            try:
+                with connection.begin():
+                    function(connection)
+                    if suspend and connection.exec_driver_sql('PRAGMA foreign_key_check').first():
+                        raise RuntimeError(f'migration {version} left rows violating foreign keys')
+                    record(connection, version, name)
+            finally:
+                if suspend:
+                    connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+                    connection.commit()
+        applied.append(f'{version:04d} {name}')
+    return applied
@@ -0,0 +1,90 @@
+# Password hashing policy with a configurable algorithm and cost.
+#
+# Hashes use Werkzeug's "method$salt$hash" format, so existing hashes keep
+# verifying: scrypt:n:r:p, pbkdf2:<hash>:<iterations> and the legacy plain
+# "sha256" HMAC that register() used to write. The slow work runs on a
+# bounded thread pool (hashlib releases the GIL), so only so many hashes are
+# ever in flight and request threads aren't starved by them.
+import hashlib
+import hmac
+import os
+import secrets
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SALT_CHARS = string.ascii_letters + string.digits
+
+
+class PasswordBusy(Exception):
+    """Raised when too many hashes are already queued."""
+
+
+def _parse(method):
+    family, *params = method.split(':')
+    if family == 'scrypt' and len(params) == 3:
+        return family, [int(value) for value in params]
+    if family == 'pbkdf2' and len(params) == 2 and params[0] in hashlib.algorithms_available:
+        return family, [params[0], int(params[1])]
+    if not params and family in hashlib.algorithms_available:
+        return 'hmac', [family]
+    raise ValueError(f'unsupported password hash method {method!r}')
+
+
+def _digest(method, salt, password):
+    family, params = _parse(method)
+    if family == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(password.encode(), salt=salt.encode(), n=n, r=r, p=p,
+                              maxmem=132 * n * r * p).hex()
+    if family == 'pbkdf2':
+        hash_name, iterations = params
+        return hashlib.pbkdf2_hmac(hash_name, password.encode(), salt.encode(), iterations).hex()
+    return hmac.new(salt.encode(), password.encode(), params[0]).hexdigest()
+
+
+class PasswordPolicy:
+    def __init__(self, method='scrypt:32768:8:1', workers=4, max_pending=64, salt_length=16):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self.salt_length = salt_length
+        self.pool = None
+        self.slots = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers)
+        self.max_pending = app.config.get('PASSWORD_HASH_MAX_PENDING', self.max_pending)
+        _parse(self.method)  # fail at startup on a bad method
+
+    def _run(self, function, *args):
+        # created on first use, and again in a forked worker where the threads didn't survive
+        with self.lock:
+            if self.pool is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password')
+                self.slots = threading.BoundedSemaphore(self.max_pending)
+        if not self.slots.acquire(blocking=False):
+            raise PasswordBusy()
+        try:
+            return self.pool.submit(function, *args).result()
+        finally:
+            self.slots.release()
+
+    def hash(self, password):
+        salt = ''.join(secrets.choice(SALT_CHARS) for _ in range(self.salt_length))
+        return f'{self.method}${salt}${self._run(_digest, self.method, salt, password)}'
+
+    def verify(self, pwhash, password):
+        try:
+            method, salt, expected = pwhash.split('$', 2)
+            actual = self._run(_digest, method, salt, password)
+        except ValueError:
+            return False
+        return hmac.compare_digest(actual, expected)
+
+    def needs_rehash(self, pwhash):
+        return pwhash.split('$', 1)[0] != self.method
@@ -0,0 +1,99 @@
+# Opt-in per-request SQL profiler (SQL_PROFILING=1)
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger('profiler')
+
+
+def percentile(values, pct):
+    # nearest-rank percentile of an already sorted list
+    if not values:
+        return 0
+    index = max(0, min(len(values) - 1, round(pct / 100 * len(values)) - 1))
+    return values[index]
+
+
+class QueryProfiler:
+    def __init__(self, samples_per_route=1000, slowest_kept=5):
+        self.enabled = False
+        self.slowest_kept = slowest_kept
+        self.slow_query_ms = 100
+        # endpoint -> recent (queries, db_ms, total_ms) samples
+        self.samples = defaultdict(lambda: deque(maxlen=samples_per_route))
+        # endpoint -> slowest (ms, statement) seen so far
+        self.slowest = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def init_app(self, app, engine):
+        # with profiling off nothing is hooked, so the cost is zero
+        self.enabled = app.config.get('SQL_PROFILING', False)
+        if not self.enabled:
+            return
+        self.slow_query_ms = app.config.get('SQL_SLOW_QUERY_MS', 100)
+        event.listen(engine, 'before_cursor_execute', self._before_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_execute)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiler_started', []).append(time.perf_counter())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['profiler_started'].pop()
+        if not has_request_context() or '_profile' not in g:
+            return
+        elapsed = (time.perf_counter() - started) * 1000
+        profile = g._profile
+        profile['queries'] += 1
+        profile['db_ms'] += elapsed
+        profile['statements'].append((elapsed, statement))
+        if elapsed >= self.slow_query_ms:
+            logger.warning('slow query %.1fms on %s: %s', elapsed, request.endpoint, statement)
+
+    def _start_request(self):
+        g._profile = {'started': time.perf_counter(), 'queries': 0, 'db_ms': 0.0, 'statements': []}
+
+    def _finish_request(self, response):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return response
+        total_ms = (time.perf_counter() - profile['started']) * 1000
+        endpoint = request.endpoint or 'unmatched'
+        response.headers['X-Query-Count'] = str(profile['queries'])
+        response.headers['X-DB-Time'] = f"{profile['db_ms']:.2f}"
+        response.headers['Server-Timing'] = f"db;dur={profile['db_ms']:.2f}, app;dur={total_ms:.2f}"
+        logger.info('%s %s: %d queries, %.1fms db, %.1fms total',
+                    request.method, endpoint, profile['queries'], profile['db_ms'], total_ms)
+
+        with self.lock:
+            self.samples[endpoint].append((profile['queries'], profile['db_ms'], total_ms))
+            slowest = self.slowest[endpoint]
+            slowest.extend(profile['statements'])
+            slowest.sort(key=lambda item: item[0], reverse=True)
+            del slowest[self.slowest_kept:]
+        return response
+
+    def stats(self):
+        with self.lock:
+            snapshot = {endpoint: (list(samples), list(self.slowest[endpoint]))
+                        for endpoint, samples in self.samples.items()}
+        routes = []
+        for endpoint, (samples, slowest) in sorted(snapshot.items()):
+            queries = sorted(sample[0] for sample in samples)
+            db_ms = sorted(sample[1] for sample in samples)
+            total_ms = sorted(sample[2] for sample in samples)
+            routes.append({
+                'endpoint': endpoint,
+                'requests': len(samples),
+                'queries': {pct: percentile(queries, pct) for pct in (50, 95, 99)},
+                'db_ms': {pct: percentile(db_ms, pct) for pct in (50, 95, 99)},
+                'total_ms': {pct: percentile(total_ms, pct) for pct in (50, 95, 99)},
+                'slowest': slowest,
+            })
+        return routes
+
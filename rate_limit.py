@@ -0,0 +1,157 @@
+# Token-bucket rate limiting
+#
+# Every (rule, key) pair has a bucket of `capacity` tokens that refills
+# evenly over `period` seconds; a request takes one token or is refused with
+# the seconds until the next one. A bucket left alone for a whole period is
+# full again, which is what a missing bucket means too, so such buckets are
+# dropped lazily as requests come in instead of by a sweeper thread.
+#
+# Buckets live in this process by default. RATE_LIMIT_SQLITE_PATH moves them
+# into a SQLite file that every worker on the host shares.
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+logger = logging.getLogger('rate_limit')
+
+
+def parse_limits(text):
+    # "login=10/60,register=5/3600" -> {'login': (10, 60.0), 'register': (5, 3600.0)}
+    limits = {}
+    for item in filter(None, (part.strip() for part in (text or '').split(','))):
+        rule, _, spec = item.partition('=')
+        capacity, _, period = spec.partition('/')
+        limits[rule.strip()] = (int(capacity), float(period))
+    return limits
+
+
+def refill(tokens, updated, capacity, period, now):
+    return min(capacity, tokens + (now - updated) * capacity / period)
+
+
+def spend(tokens, capacity, period):
+    # (allowed, tokens left, seconds until the next token)
+    if tokens >= 1:
+        return True, tokens - 1, 0.0
+    return False, tokens, (1 - tokens) * period / capacity
+
+
+class MemoryBuckets:
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        # rule -> key -> [tokens, updated], least recently used first
+        self.rules = defaultdict(OrderedDict)
+        self.lock = threading.Lock()
+
+    def take(self, rule, key, capacity, period, now):
+        with self.lock:
+            buckets = self.rules[rule]
+            # the least recently used buckets are the first to have refilled
+            while buckets:
+                oldest = next(iter(buckets.values()))
+                if oldest[1] + period > now:
+                    break
+                buckets.popitem(last=False)
+            bucket = buckets.pop(key, None)
+            tokens = capacity if bucket is None else refill(bucket[0], bucket[1], capacity, period, now)
+            allowed, tokens, retry_after = spend(tokens, capacity, period)
+            buckets[key] = [tokens, now]
+            if len(buckets) > self.max_keys:
+                buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def size(self):
+        return sum(len(buckets) for buckets in self.rules.values())
+
+
+class SqliteBuckets:
+    # one row per bucket; BEGIN IMMEDIATE serializes workers on the read-modify-write
+    SWEEP_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.takes = 0
+
+    def _connection(self):
+        # one connection per thread, and new ones in a forked worker
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute('CREATE TABLE IF NOT EXISTS bucket (rule TEXT NOT NULL, key TEXT NOT NULL, '
+                               'tokens REAL NOT NULL, updated REAL NOT NULL, PRIMARY KEY (rule, key)) WITHOUT ROWID')
+            connection.execute('CREATE INDEX IF NOT EXISTS ix_bucket_rule_updated ON bucket (rule, updated)')
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return self.local.connection
+
+    def take(self, rule, key, capacity, period, now):
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT tokens, updated FROM bucket WHERE rule = ? AND key = ?',
+                                     (rule, key)).fetchone()
+            tokens = capacity if row is None else refill(row[0], row[1], capacity, period, now)
+            allowed, tokens, retry_after = spend(tokens, capacity, period)
+            connection.execute('INSERT INTO bucket (rule, key, tokens, updated) VALUES (?, ?, ?, ?) '
+                               'ON CONFLICT (rule, key) DO UPDATE SET tokens = excluded.tokens, '
+                               'updated = excluded.updated', (rule, key, tokens, now))
+            self.takes += 1
+            if self.takes % self.SWEEP_EVERY == 0:
+                connection.execute('DELETE FROM bucket WHERE rule = ? AND updated <= ?', (rule, now - period))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return allowed, retry_after
+
+    def size(self):
+        return self._connection().execute('SELECT count(*) FROM bucket').fetchone()[0]
+
+
+class RateLimiter:
+    def __init__(self):
+        self.enabled = True
+        self.limits = {}
+        self.store = MemoryBuckets()
+        self.allowed = defaultdict(int)
+        self.limited = defaultdict(int)
+        self.errors = 0
+
+    def init_app(self, app):
+        # RATE_LIMITS: {rule: (capacity, period in seconds)}
+        self.enabled = app.config.get('RATE_LIMIT_ENABLED', True)
+        self.limits = dict(app.config.get('RATE_LIMITS', {}))
+        path = app.config.get('RATE_LIMIT_SQLITE_PATH')
+        if path:
+            self.store = SqliteBuckets(path)
+        else:
+            self.store = MemoryBuckets(app.config.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+    def hit(self, rule, key):
+        # None when allowed, else the seconds until the key may try again
+        limit = self.limits.get(rule)
+        if not self.enabled or limit is None:
+            return None
+        try:
+            allowed, retry_after = self.store.take(rule, key, limit[0], limit[1], time.time())
+        except sqlite3.Error:
+            # an unavailable store lets requests through rather than taking the site down
+            logger.exception('rate limit store failed')
+            self.errors += 1
+            return None
+        if allowed:
+            self.allowed[rule] += 1
+            return None
+        self.limited[rule] += 1
+        return retry_after
+
+    def stats(self):
+        stats = {'buckets': self.store.size(), 'store_errors': self.errors}
+        for rule in self.limits:
+            stats[f'{rule}_allowed'] = self.allowed[rule]
+            stats[f'{rule}_limited'] = self.limited[rule]
+        return stats
@@ -0,0 +1,98 @@
+# Full-text search over posts and comments (SQLite FTS5, see migration 4)
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+# FTS5 snippet() markers, swapped for <mark> after the text is HTML-escaped
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+SEARCH_SQL = text(
+    "SELECT rowid, post_id, "
+    "snippet(search_index, 0, :start, :end, '…', 12) AS title, "
+    "snippet(search_index, 1, :start, :end, '…', 24) AS body "
+    "FROM search_index WHERE search_index MATCH :query "
+    "ORDER BY rank LIMIT :limit OFFSET :offset")
+
+# keep the index in step with post and comment writes; posts use rowid 2*id
+# and comments 2*id+1, so each trigger touches a single row by rowid
+TRIGGERS = {
+    'search_post_insert': "AFTER INSERT ON post BEGIN "
+    "INSERT INTO search_index (rowid, title, body, post_id) VALUES (new.id * 2, new.title, new.content, new.id); "
+    "END",
+    'search_post_update': "AFTER UPDATE OF title, content ON post BEGIN "
+    "UPDATE search_index SET title = new.title, body = new.content WHERE rowid = new.id * 2; "
+    "END",
+    'search_post_delete': "AFTER DELETE ON post BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id * 2; "
+    "END",
+    'search_comment_insert': "AFTER INSERT ON comment BEGIN "
+    "INSERT INTO search_index (rowid, title, body, post_id) VALUES (new.id * 2 + 1, '', new.content, new.post_id); "
+    "END",
+    'search_comment_update': "AFTER UPDATE OF content ON comment BEGIN "
+    "UPDATE search_index SET body = new.content WHERE rowid = new.id * 2 + 1; "
+    "END",
+    'search_comment_delete': "AFTER DELETE ON comment BEGIN "
+    "DELETE FROM search_index WHERE rowid = old.id * 2 + 1; "
+    "END",
+}
+
+
+def available(connection):
+    return connection.dialect.name == 'sqlite'
+
+
+def match_query(terms):
+    # user input never reaches the FTS5 query syntax: every word is quoted,
+    # words are ANDed together, and the last one matches as a prefix
+    words = re.findall(r'\w+', terms)
+    if not words:
+        return None
+    quoted = [f'"{word}"' for word in words]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def highlight(snippet):
+    return Markup(escape(snippet)
+                  .replace(MATCH_START, Markup('<mark>'))
+                  .replace(MATCH_END, Markup('</mark>')))
+
+
+def search(connection, terms, page=1, per_page=20):
+    # one indexed FTS query per page; returns (hits, has_more)
+    query = match_query(terms)
+    if query is None:
+        return [], False
+    rows = connection.execute(SEARCH_SQL, {
+        'start': MATCH_START, 'end': MATCH_END, 'query': query,
+        'limit': per_page + 1, 'offset': (page - 1) * per_page,
+    }).all()
+    hits = [{
+        'kind': 'comment' if row.rowid % 2 else 'post',
+        'post_id': row.post_id,
+        'title': highlight(row.title),
+        'body': highlight(row.body),
+    } for row in rows[:per_page]]
+    return hits, len(rows) > per_page
+
+
+def create_triggers(connection):
+    for name, body in TRIGGERS.items():
+        connection.execute(text(f'CREATE TRIGGER IF NOT EXISTS {name} {body}'))
+
+
+def drop_triggers(connection):
+    # for bulk loads, which are cheaper to index in one rebuild_index() afterwards
+    for name in TRIGGERS:
+        connection.execute(text(f'DROP TRIGGER IF EXISTS {name}'))
+
+
+def rebuild_index(connection):
+    connection.execute(text('DELETE FROM search_index'))
+    connection.execute(text(
+        'INSERT INTO search_index (rowid, title, body, post_id) SELECT id * 2, title, content, id FROM post'))
+    connection.execute(text(
+        "INSERT INTO search_index (rowid, title, body, post_id) "
+        "SELECT id * 2 + 1, '', content, post_id FROM comment"))
+    connection.execute(text("INSERT INTO search_index (search_index) VALUES ('optimize')"))
@@ -0,0 +1,20 @@
+# Process facts for serving: memory use and live threads, read cheaply
+# enough for a metrics page or a gunicorn hook
+import os
+import resource
+import sys
+import threading
+
+
+def rss_bytes():
+    # current resident set size; the peak where /proc isn't available
+    try:
+        with open('/proc/self/statm') as handle:
+            return int(handle.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def thread_count():
+    return threading.active_count()
@@ -0,0 +1,21 @@
+# Model change events; caches and live views subscribe to these
+from blinker import Namespace
+
+_signals = Namespace()
+
+# sent with post_id after a post row or its counters changed
+post_changed = _signals.signal('post-changed')
+# sent with post_id after a post was deleted
+post_deleted = _signals.signal('post-deleted')
+# sent with post_id and the new comment after it was committed
+comment_added = _signals.signal('comment-added')
+# sent with post_id and comment_id after a comment was deleted
+comment_deleted = _signals.signal('comment-deleted')
+# sent with {category_id: change in post count} after posts were tagged, untagged or deleted
+category_counts_changed = _signals.signal('category-counts-changed')
+# sent with the new category after it was committed
+category_added = _signals.signal('category-added')
+# sent with post_ids after many posts changed at once, in place of post_changed for each
+posts_changed = _signals.signal('posts-changed')
+# sent with {post_id: number of new likes} after a batch of likes was committed
+likes_added = _signals.signal('likes-added')
@@ -0,0 +1,99 @@
+// Live likes and comments: send them without a page reload and patch the
+// counters and comment lists of every post on the page from Socket.IO events
+(function () {
+  var userId = document.body.dataset.userId;
+
+  function each(selector, callback) {
+    document.querySelectorAll(selector).forEach(callback);
+  }
+
+  function setLikes(postId, likes) {
+    each('[data-like-count="' + postId + '"]', function (el) { el.textContent = likes; });
+  }
+
+  function commentItem(list, comment) {
+    var item = document.createElement('li');
+    item.className = 'list-group-item';
+    item.dataset.commentId = comment.id;
+    item.appendChild(document.createTextNode(comment.content));
+    var row = document.createElement('div');
+    row.className = 'd-flex';
+    var author = document.createElement('small');
+    author.className = 'text-muted';
+    author.textContent = 'Author: ' + comment.author;
+    row.appendChild(author);
+    if (String(comment.author_id) === userId) {
+      var remove = document.createElement('a');
+      remove.className = 'btn btn-sm btn-danger ms-auto';
+      remove.href = list.dataset.deleteUrl.replace(/0$/, comment.id);
+      remove.textContent = 'Delete';
+      remove.onclick = function () { return confirm('Are you sure!'); };
+      row.appendChild(remove);
+    }
+    item.appendChild(row);
+    return item;
+  }
+
+  var postIds = [];
+  each('[data-post-id]', function (el) {
+    if (postIds.indexOf(el.dataset.postId) === -1) postIds.push(el.dataset.postId);
+  });
+
+  var socket = null;
+  if (postIds.length && typeof io !== 'undefined') {
+    socket = io();
+    socket.on('connect', function () { socket.emit('join_posts', postIds.map(Number)); });
+    socket.on('post_stats', function (data) {
+      setLikes(data.post_id, data.likes);
+      each('[data-comment-count="' + data.post_id + '"]', function (el) { el.textContent = data.comments; });
+    });
+    socket.on('comment_added', function (data) {
+      each('[data-comments="' + data.post_id + '"][data-live-append]', function (list) {
+        if (!list.querySelector('[data-comment-id="' + data.id + '"]')) list.appendChild(commentItem(list, data));
+      });
+    });
+    socket.on('comment_deleted', function (data) {
+      each('[data-comments="' + data.post_id + '"] [data-comment-id="' + data.id + '"]', function (el) { el.remove(); });
+    });
+  }
+
+  function send(url, options) {
+    options.headers = { Accept: 'application/json' };
+    return fetch(url, options).then(function (response) {
+      if (!response.ok) {
+        var error = new Error(response.statusText);
+        error.status = response.status;
+        throw error;
+      }
+      return response.json();
+    });
+  }
+
+  document.addEventListener('click', function (event) {
+    var link = event.target.closest('[data-like]');
+    if (!link) return;
+    event.preventDefault();
+    event.stopPropagation();
+    send(link.href, { method: 'POST' })
+      // likes are written in batches and the new count arrives as a post_stats
+      // event; without a socket, reload once the batch has had time to land
+      .then(function () {
+        if (!socket || !socket.connected) setTimeout(function () { window.location.reload(); }, 1000);
+      })
+      // rate limited: falling back to the plain link would only be refused again
+      .catch(function (error) { if (error.status !== 429) window.location = link.href; });
+  });
+
+  document.addEventListener('submit', function (event) {
+    var form = event.target.closest('[data-live-comment]');
+    if (!form) return;
+    event.preventDefault();
+    send(form.action, { method: 'POST', body: new FormData(form) })
+      .then(function () {
+        form.reset();
+        // without a socket the new comment only shows up on reload
+        if (!socket || !socket.connected) window.location.reload();
+      })
+      .catch(function (error) { if (error.status !== 429) form.submit(); });
+  });
+})();
@@ -0,0 +1,55 @@
+# The app reads its configuration from the environment at import, so the
+# test database and settings are put in place before anything imports it.
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = tempfile.mkdtemp(prefix='app-tests-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(DATA_DIR, "test.db")}'
+os.environ['SQL_PROFILING'] = '1'
+os.environ['RATE_LIMIT_ENABLED'] = '0'
+os.environ['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000'
+sys.path.insert(0, ROOT)
+
+PASSWORD = 'test-password'
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    import app as app_module
+    app_module.upgrade_db()
+    return app_module
+
+
+@pytest.fixture
+def db(app_module):
+    with app_module.app.app_context():
+        yield app_module.db
+        app_module.db.session.remove()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def make_user(app_module, db):
+    # a user with a user_stats row, as registration creates them
+    def make_user(username):
+        user = app_module.User(username=username, email=f'{username}@example.com',
+                               password=app_module.password_policy.hash(PASSWORD))
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(app_module.UserStats(user_id=user.id))
+        db.session.commit()
+        return user.id
+    return make_user
+
+
+def login(client, username):
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    assert response.status_code == 302
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import login
+
+
+@pytest.fixture
+def activity(app_module, db, make_user):
+    # a leaving user with posts, likes and comments on their own posts and on
+    # others', and others' likes and comments on theirs
+    def activity(prefix):
+        leaving, *others = [make_user(f'{prefix}-{index}') for index in range(4)]
+        posts = []
+        for author_id in (leaving, leaving, others[0], others[1]):
+            post = app_module.Post(title=f'{prefix} post', content='Body', author_id=author_id)
+            db.session.add(post)
+            db.session.flush()
+            posts.append(post.id)
+        for user_id in (leaving, *others):
+            for post_id in posts:
+                db.session.add(app_module.Like(user_id=user_id, post_id=post_id))
+                db.session.add(app_module.Comment(content='Comment', author_id=user_id, post_id=post_id))
+        db.session.commit()
+        app_module.reconcile_counters()
+        app_module.reconcile_user_stats()
+        return leaving
+    return activity
+
+
+def assert_counters_hold(app_module, db):
+    db.session.expire_all()
+    assert app_module.reconcile_counters() == 0
+    assert app_module.reconcile_user_stats() == 0
+
+
+def test_deleting_an_account_keeps_counters_in_step(app_module, db, client, activity):
+    leaving = activity('leaving-now')
+    login(client, 'leaving-now-0')
+    assert client.get('/delete_account').status_code == 302
+
+    assert db.session.get(app_module.User, leaving) is None
+    assert_counters_hold(app_module, db)
+
+
+def test_deleting_an_account_in_chunks_keeps_counters_in_step(app_module, db, activity):
+    leaving = activity('leaving-later')
+    # small chunks, so likes and comments go over several steps
+    while app_module.delete_account_chunk(leaving, 3):
+        pass
+
+    assert db.session.get(app_module.User, leaving) is None
+    assert_counters_hold(app_module, db)
+
+
+def test_a_deletion_left_by_an_exited_worker_is_taken_over(app_module, db, client, activity):
+    leaving = activity('leaving-abandoned')
+    db.session.get(app_module.User, leaving).password = '!deleted'
+    # held by a worker that stopped touching it, and one still at work
+    stale = datetime.utcnow() - timedelta(seconds=app_module.account_deletions.lease + 1)
+    db.session.add_all([
+        app_module.AccountDeletion(id='abandoned', user_id=leaving, total=10, state='running',
+                                   runner='gone:1', touched_at=stale),
+        app_module.AccountDeletion(id='held', user_id=leaving, total=10, state='running',
+                                   runner='busy:1', touched_at=datetime.utcnow()),
+    ])
+    db.session.commit()
+    assert 'abandoned' in app_module.unfinished_account_deletions(False)
+
+    assert app_module.account_deletions.run('held') is False
+    assert app_module.account_deletions.run('abandoned') is True
+
+    assert db.session.get(app_module.User, leaving) is None
+    assert_counters_hold(app_module, db)
+    progress = client.get('/account_deletion/abandoned').get_json()
+    assert progress['state'] == 'done'
+    assert progress['percent'] == 100.0
@@ -0,0 +1,39 @@
+from like_buffer import LikeBuffer
+
+
+def failing(times):
+    # a write that fails the first `times` calls, like a locked database
+    calls = []
+
+    def write(batch):
+        calls.append(list(batch))
+        if len(calls) <= times:
+            raise RuntimeError('database is locked')
+        return len(batch)
+    return write, calls
+
+
+def test_a_failed_flush_keeps_the_batch_for_the_next_one():
+    # the background thread waits an hour, so only the test flushes
+    buffer = LikeBuffer(flush_interval=3600, max_attempts=3)
+    buffer.write, calls = failing(1)
+    buffer.add(1, 10)
+    buffer.add(2, 10)
+    assert buffer.flush() == 0
+    buffer.add(3, 10)
+
+    assert buffer.flush() == 3
+    assert calls[-1] == [(1, 10), (2, 10), (3, 10)]
+    assert buffer.stats()['failed'] == 0
+
+
+def test_a_batch_is_dropped_only_after_repeated_failures():
+    buffer = LikeBuffer(flush_interval=3600, max_attempts=3)
+    buffer.write, calls = failing(3)
+    buffer.add(1, 10)
+    for _ in range(3):
+        buffer.flush()
+
+    assert len(calls) == 3
+    assert buffer.stats()['failed'] == 1
+    assert buffer.stats()['queue_depth'] == 0
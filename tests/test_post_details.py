@@ -0,0 +1,34 @@
+from conftest import login
+
+
+def add_post(app_module, db, author_id, user_ids, title):
+    # a post liked and commented on once by each of user_ids
+    post = app_module.Post(title=title, content='Body', author_id=author_id)
+    db.session.add(post)
+    db.session.flush()
+    for user_id in user_ids:
+        db.session.add(app_module.Like(user_id=user_id, post_id=post.id))
+        db.session.add(app_module.Comment(content=f'Comment by {user_id}', author_id=user_id, post_id=post.id))
+    db.session.commit()
+    app_module.reconcile_counters()
+    return post.id
+
+
+def query_count(client, url):
+    response = client.get(url)
+    assert response.status_code == 200
+    return int(response.headers['X-Query-Count'])
+
+
+def test_query_count_does_not_grow_with_likes_and_comments(app_module, db, client, make_user):
+    author = make_user('details-author')
+    fans = [make_user(f'details-fan-{index}') for index in range(60)]
+    quiet = add_post(app_module, db, author, fans[:1], 'Quiet post')
+    busy = add_post(app_module, db, author, fans, 'Busy post')
+    login(client, 'details-author')
+    # the first request after login also loads the user
+    query_count(client, '/posts')
+
+    expected = query_count(client, f'/post.{quiet}')
+    assert query_count(client, f'/post.{busy}') == expected
+    assert query_count(client, f'/post.{busy}?after=1') == expected
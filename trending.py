@@ -0,0 +1,183 @@
+# Trending posts: time-decayed likes and comments, ranked in memory
+#
+# An event of weight w at time t adds w * 2^((t - EPOCH) / half_life) to its
+# post's score. Ranking by that sum is the same as ranking by the decayed
+# score at any later moment, so nothing is ever rescored as time passes.
+# Sums are kept as log2 values, which never overflow. The ranking is a list
+# kept sorted by bisect, so the top K is a slice. Changes are merged into the
+# trending_score table in the background, where a restart (or another worker)
+# loads them back from.
+import atexit
+import bisect
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger('trending')
+
+EPOCH = 1577836800  # 2020-01-01 UTC
+# scores decayed below 2^-FORGET_AFTER of a single like are dropped
+FORGET_AFTER = 30
+
+
+def add_log2(a, b):
+    # log2(2^a + 2^b)
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+class TrendingIndex:
+    def __init__(self, half_life=86400, capacity=10000, persist_interval=60):
+        self.half_life = half_life
+        self.capacity = capacity
+        self.persist_interval = persist_interval
+        self.load = None
+        self.save = None
+        self.scores = {}
+        # (-score, post_id), best first
+        self.ranking = []
+        # log2 sums not yet merged into the table
+        self.pending = {}
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.persist_lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.closed = False
+        self.events = 0
+        self.persists = 0
+        self.failed = 0
+
+    def init_app(self, app, load, save):
+        # load(limit) returns the best (post_id, score) rows; save({post_id: log2 sum}, forget_below)
+        # merges sums in and drops scores below forget_below
+        self.load = load
+        self.save = save
+        self.half_life = app.config.get('TRENDING_HALF_LIFE_HOURS', self.half_life / 3600) * 3600
+        self.capacity = app.config.get('TRENDING_CAPACITY', self.capacity)
+        self.persist_interval = app.config.get('TRENDING_PERSIST_INTERVAL', self.persist_interval)
+        atexit.register(self.close)
+
+    def now(self, at=None):
+        # the log2 weight of a unit event at time `at`
+        return ((at if at is not None else time.time()) - EPOCH) / self.half_life
+
+    def decayed(self, score, at=None):
+        # the score as of `at`, in likes
+        return 2 ** (score - self.now(at))
+
+    def _place(self, post_id, score):
+        # call with the lock held
+        old = self.scores.get(post_id)
+        if old is not None:
+            del self.ranking[bisect.bisect_left(self.ranking, (-old, post_id))]
+        self.scores[post_id] = score
+        bisect.insort(self.ranking, (-score, post_id))
+        if len(self.ranking) > self.capacity:
+            _, dropped = self.ranking.pop()
+            del self.scores[dropped]
+
+    def _ensure_loaded(self):
+        # call with the lock held
+        if not self.loaded:
+            self._replace(self.load(self.capacity))
+
+    def _replace(self, rows):
+        # call with the lock held; pending changes aren't in the table yet, so they go on top
+        self.scores, self.ranking = {}, []
+        for post_id, score in rows:
+            self.scores[post_id] = score
+            self.ranking.append((-score, post_id))
+        self.ranking.sort()
+        for post_id, delta in self.pending.items():
+            self._place(post_id, add_log2(self.scores.get(post_id), delta))
+        self.loaded = True
+
+    def warm(self):
+        # load without starting the persist thread, e.g. in a process about to fork
+        with self.lock:
+            self._ensure_loaded()
+
+    def record(self, post_id, weight, at=None):
+        delta = math.log2(weight) + self.now(at)
+        with self.lock:
+            self._ensure_loaded()
+            self._place(post_id, add_log2(self.scores.get(post_id), delta))
+            self.pending[post_id] = add_log2(self.pending.get(post_id), delta)
+            self.events += 1
+        self._ensure_thread()
+
+    def remove(self, post_id):
+        with self.lock:
+            self.pending.pop(post_id, None)
+            score = self.scores.pop(post_id, None)
+            if score is not None:
+                del self.ranking[bisect.bisect_left(self.ranking, (-score, post_id))]
+
+    def top(self, count, offset=0):
+        # [(post_id, score)], best first
+        with self.lock:
+            self._ensure_loaded()
+            ranked = [(post_id, -score) for score, post_id in self.ranking[offset:offset + count]]
+        # the periodic reload also brings in what other workers recorded
+        self._ensure_thread()
+        return ranked
+
+    def _ensure_thread(self):
+        # started on first use, and again in a forked worker where the thread didn't survive
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._run, name='trending-persist', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.persist_interval)
+            self.persist()
+
+    def persist(self):
+        # merge pending sums into the table, then reload the best rows, which
+        # picks up whatever other workers merged in meanwhile
+        with self.persist_lock:
+            with self.lock:
+                batch, self.pending = self.pending, {}
+            try:
+                self.save(batch, self.now() - FORGET_AFTER)
+                rows = self.load(self.capacity)
+            except Exception:
+                logger.exception('trending scores for %d posts not saved', len(batch))
+                with self.lock:
+                    for post_id, delta in batch.items():
+                        self.pending[post_id] = add_log2(self.pending.get(post_id), delta)
+                self.failed += 1
+                return
+            with self.lock:
+                self._replace(rows)
+            self.persists += 1
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        if self.thread is not None and self.pid == os.getpid():
+            self.thread.join(timeout=5)
+        if self.pending:
+            self.persist()
+
+    def stats(self):
+        return {
+            'ranked': len(self.ranking),
+            'capacity': self.capacity,
+            'pending': len(self.pending),
+            'events': self.events,
+            'persists': self.persists,
+            'failed': self.failed,
+            'half_life_hours': self.half_life / 3600,
+        }
@@ -0,0 +1,9 @@
+# Production entry point:
+#
+#     gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Run `flask --app app upgrade-db` first; /readyz answers 503 while
+# migrations are pending.
+from app import create_app
+
+app = create_app()